@@ -8,6 +8,9 @@ Email categories include:
 is soon
 """
 
+# standard library
+import functools
+
 
 class EpicastEmails:
   """Templating for Epicast emails."""
@@ -235,6 +238,21 @@ class EpicastEmails:
     """Trim surrounding whitespace and use network-style CRLF line endings."""
     return '\r\n'.join([line.strip() for line in text.split('\n')]).strip()
 
+  @staticmethod
+  @functools.lru_cache(maxsize=None)
+  def prepare_templates(text_template, html_template):
+    """Append the unsubscribe section to, and prepare, a pair of templates.
+
+    Templates are constant, so the result is cached and each template is only
+    prepared once regardless of how many emails are generated from it.
+    """
+
+    text = EpicastEmails.prepare(
+        text_template + EpicastEmails.Template.UNSUBSCRIBE['text'])
+    html = EpicastEmails.prepare(
+        html_template + EpicastEmails.Template.UNSUBSCRIBE['html'])
+    return text, html
+
   @staticmethod
   def compose(
       user_id,
@@ -247,13 +265,10 @@ class EpicastEmails:
 
     final_subject = EpicastEmails.Template.SUBJECT_TAG + ' ' + subject
 
-    text_template += EpicastEmails.Template.UNSUBSCRIBE['text']
-    text_values += (user_id,)
-    final_text = EpicastEmails.prepare(text_template) % text_values
-
-    html_template += EpicastEmails.Template.UNSUBSCRIBE['html']
-    html_values += (user_id,)
-    temp_html = EpicastEmails.prepare(html_template) % html_values
+    text_template, html_template = EpicastEmails.prepare_templates(
+        text_template, html_template)
+    final_text = text_template % (text_values + (user_id,))
+    temp_html = html_template % (html_values + (user_id,))
     final_html = '<html><body>' + temp_html + '</body></html>'
 
     return final_subject, final_text, final_html
@@ -272,30 +287,37 @@ class EpicastEmails:
         values,
         values)
 
+  @staticmethod
+  @functools.lru_cache(maxsize=None)
+  def get_notification_templates(include_score):
+    """Return the notification templates with or without the score section."""
+
+    template = EpicastEmails.Template.NOTIFICATION
+    if include_score:
+      score = EpicastEmails.Template.SCORE
+    else:
+      score = {'text': '', 'html': ''}
+    text = template['text'].replace('{SCORE}', score['text'])
+    html = template['html'].replace('{SCORE}', score['html'])
+    return text, html
+
   @staticmethod
   def get_notification(
       user_id, user_name, last_score, last_rank, total_score, total_rank):
     """Fill out and return the notification email."""
 
-    template = EpicastEmails.Template.NOTIFICATION
-    subject = template['subject']
-    text = template['text']
-    html = template['html']
+    subject = EpicastEmails.Template.NOTIFICATION['subject']
+    include_score = last_score > 0
+    text, html = EpicastEmails.get_notification_templates(include_score)
 
     text_values = (user_name, user_id)
     html_values = (user_name, user_id, user_id)
 
-    if last_score > 0:
-      # include the embedded scoring section
-      text = text.replace('{SCORE}', EpicastEmails.Template.SCORE['text'])
-      html = html.replace('{SCORE}', EpicastEmails.Template.SCORE['html'])
+    if include_score:
+      # fill in the embedded scoring section
       score_values = (total_score, total_rank, user_id)
       text_values += score_values
       html_values += score_values
-    else:
-      # omit the embedded scoring section
-      text = text.replace('{SCORE}', '')
-      html = html.replace('{SCORE}', '')
 
     return EpicastEmails.compose(
         user_id, subject, text, html, text_values, html_values)
@@ -7,6 +7,7 @@ to be emailed.
 # standard library
 import argparse
 import base64
+from concurrent.futures import ThreadPoolExecutor
 import json
 import random
 
@@ -19,6 +20,11 @@ import delphi.operations.emailer as emailer
 import delphi.operations.secrets as secrets
 
 
+# upper bound on the number of emails queued in parallel, since each one is a
+# separate request to the email queue
+MAX_CONCURRENCY = 16
+
+
 def get_argument_parser():
   """Define command line arguments and usage."""
 
@@ -51,6 +57,14 @@ def get_argument_parser():
       const=True,
       default=False,
       help='force match on myself')
+  parser.add_argument(
+      '-c',
+      '--concurrency',
+      type=int,
+      default=5,
+      help=(
+        'number of emails to queue in parallel, at most %d (default: 5)' %
+        MAX_CONCURRENCY))
   parser.add_argument(
       'type',
       choices=[
@@ -62,61 +76,58 @@ def get_argument_parser():
   return parser
 
 
-def execute_sql(cur, sql):
-  """Print and execute SQL."""
+def execute_sql(cur, sql, args=(), verbose=False):
+  """Execute SQL, with values passed separately from the query.
 
-  print(sql)
-  cur.execute(sql)
+  The query is only printed in verbose mode since this is called for every
+  user.
+  """
 
+  if verbose:
+    print(sql, args)
+  cur.execute(sql, args)
 
-def get_users(cur, name, value):
+
+def get_users(cur, name, value, verbose=False):
   """Return all users having some preference."""
 
-  sql = "SELECT u.`hash`, u.`name`, u.`email` FROM ec_fluv_defaults d JOIN ec_fluv_users u ON TRUE LEFT JOIN ec_fluv_user_preferences p ON p.`user_id` = u.`id` AND p.`name` = d.`name` WHERE d.`name` = '%s' AND coalesce(p.`value`, d.`value`) = '%s'" % (name, value)
-  execute_sql(cur, sql)
+  sql = "SELECT u.`hash`, u.`name`, u.`email` FROM ec_fluv_defaults d JOIN ec_fluv_users u ON TRUE LEFT JOIN ec_fluv_user_preferences p ON p.`user_id` = u.`id` AND p.`name` = d.`name` WHERE d.`name` = %s AND coalesce(p.`value`, d.`value`) = %s"
+  execute_sql(cur, sql, (name, value), verbose)
 
-  users = []
-  for (hash, name, email) in cur:
-    users.append((hash[0:8], name, email))
-  return set(users)
+  return {(hash[0:8], name, email) for (hash, name, email) in cur}
 
 
-def get_scores(cur, user):
+def get_scores(cur, user, verbose=False):
   """Return user score info."""
 
-  sql = "SELECT coalesce(x.`total`, 0) `total`, coalesce(sum(CASE WHEN s.`total` >= x.`total` THEN 1 ELSE 0 END), (SELECT count(1) FROM ec_fluv_scores)) `total_rank`, coalesce(x.`last`, 0) `last`, coalesce(sum(CASE WHEN s.`last` >= x.`last` THEN 1 ELSE 0 END), (SELECT count(1) FROM ec_fluv_scores)) `last_score` FROM ec_fluv_scores s JOIN (SELECT s.`total`, s.`last` FROM ec_fluv_users u JOIN ec_fluv_scores s ON s.`user_id` = u.`id` WHERE u.`hash` LIKE '%s%%') x ON TRUE" % (user[0])
-  execute_sql(cur, sql)
+  sql = "SELECT coalesce(x.`total`, 0) `total`, coalesce(sum(CASE WHEN s.`total` >= x.`total` THEN 1 ELSE 0 END), (SELECT count(1) FROM ec_fluv_scores)) `total_rank`, coalesce(x.`last`, 0) `last`, coalesce(sum(CASE WHEN s.`last` >= x.`last` THEN 1 ELSE 0 END), (SELECT count(1) FROM ec_fluv_scores)) `last_score` FROM ec_fluv_scores s JOIN (SELECT s.`total`, s.`last` FROM ec_fluv_users u JOIN ec_fluv_scores s ON s.`user_id` = u.`id` WHERE u.`hash` LIKE %s) x ON TRUE"
+  execute_sql(cur, sql, (user[0] + '%',), verbose)
 
-  for (total, total_rank, last, last_rank) in cur:
-    pass
+  (total, total_rank, last, last_rank) = cur.fetchone()
   return (int(last), last_rank, int(total), total_rank)
 
 
-def already_submitted(cur, user):
+def already_submitted(cur, user, verbose=False):
   """Return whether a user has already submitted all predictions."""
 
   defaultNumRegion = 11
-  sql = "SELECT count(1) FROM ec_fluv_users u JOIN ec_fluv_submissions s ON s.`user_id` = u.`id` WHERE u.`hash` LIKE '%s%%' AND s.`epiweek_now` = (SELECT max(epiweek) FROM epidata.fluview)" % (user[0])
-  execute_sql(cur, sql)
+  sql = "SELECT count(1) FROM ec_fluv_users u JOIN ec_fluv_submissions s ON s.`user_id` = u.`id` WHERE u.`hash` LIKE %s AND s.`epiweek_now` = (SELECT max(epiweek) FROM epidata.fluview)"
+  execute_sql(cur, sql, (user[0] + '%',), verbose)
 
-  num = 0
-  for (num,) in cur:
-    pass
+  (num,) = cur.fetchone()
   return num >= defaultNumRegion
 
 
-def get_deadline_day_name(cur):
+def get_deadline_day_name(cur, verbose=False):
   """Return the name of the deadline day."""
 
   sql = "SELECT dayname(`deadline`) FROM ec_fluv_round"
-  execute_sql(cur, sql)
+  execute_sql(cur, sql, verbose=verbose)
 
-  name = None
-  for (name,) in cur:
-    pass
-  if name is None:
+  row = cur.fetchone()
+  if row is None or row[0] is None:
     raise Exception('couldnt get name of deadline day')
-  return name
+  return row[0]
 
 
 def connect_to_database(connector_impl):
@@ -137,18 +148,22 @@ def main(args, connector_impl=mysql.connector, emailer_impl=emailer):
   #DB connection
   log('Connecting to the database')
   cnx = connect_to_database(connector_impl)
-  cur = cnx.cursor()
+  # buffered, so that single-row reads via `fetchone` don't leave unread
+  # results on the connection
+  cur = cnx.cursor(buffered=True)
   log('Connected successfully')
 
   #Get deadline
-  deadline_day = get_deadline_day_name(cur)
+  deadline_day = get_deadline_day_name(cur, args.verbose)
   log('deadline is this coming %s' % deadline_day)
 
   #Build the list of recipients
   email_type = args.type
   if email_type == 'alerts':
     email_type = 'notifications'
-  users = get_users(cur, 'email_%s' % (email_type), '1') - get_users(cur, '_debug', '1')
+  users = (
+      get_users(cur, 'email_%s' % (email_type), '1', args.verbose) -
+      get_users(cur, '_debug', '1', args.verbose))
 
   log('%d users selected to receive email %s' % (len(users), args.type), True)
   if args.type == 'alerts':
@@ -156,51 +171,64 @@ def main(args, connector_impl=mysql.connector, emailer_impl=emailer):
     #log('%d of them are delphi members' % (len(users)), True)
     log('everyone in ec_fluv_users gets invited')
   if args.type == 'reminders':
-    temp = []
-    for u in users:
-      if not already_submitted(cur, u):
-        temp.append(u)
-    users = set(temp)
+    users = {u for u in users if not already_submitted(cur, u, args.verbose)}
     log('%d of them need to be reminded' % (len(users)), True)
   if args.test:
-    users = set([u for u in users if u[0] == secrets.flucontest.debug_userid])
+    users = {u for u in users if u[0] == secrets.flucontest.debug_userid}
     log('test mode - users filtered to %d' % (len(users)), True)
   if args.force:
-    users = set([u for u in users if u[0] != secrets.flucontest.debug_userid]) | set([(secrets.flucontest.debug_userid, 'Debug User', secrets.flucontest.email_maintainer)])
+    users = {u for u in users if u[0] != secrets.flucontest.debug_userid}
+    users.add((secrets.flucontest.debug_userid, 'Debug User', secrets.flucontest.email_maintainer))
     log('force mode - users filtered to %d' % (len(users)), True)
     log(users, True)
 
-  #Send the emails
-  for u in users:
-    user_id, user_name, user_email = u
-    last_score, last_rank, total_score, total_rank = get_scores(cur, u)
-
-    if args.type == 'alerts':
-      subject, text, html = EpicastEmails.get_alert(user_id, user_name)
-
-    elif args.type == 'notifications':
-      subject, text, html = EpicastEmails.get_notification(
-          user_id, user_name, last_score, last_rank, total_score, total_rank)
-
-    elif args.type == 'reminders':
-      subject, text, html = EpicastEmails.get_reminder(user_id, user_name)
-
-    else:
-      raise Exception('not implemented')
-
-    if args.print:
-      log('%s -> %s\n%s' % (subject, user_email, text), True)
-    else:
-      # smear emails over time by setting a random priority which the emailer
-      # will use to determine email batches
-      priority = random.random()
-      emailer_impl.queue_email(
-          to=user_email,
-          subject=subject,
-          text=text,
-          html=html,
-          priority=priority)
+  #Pick the email template once, up front
+  if args.type == 'alerts':
+    def get_email(user):
+      return EpicastEmails.get_alert(user[0], user[1])
+  elif args.type == 'notifications':
+    def get_email(user):
+      # only notifications include the user's score
+      last_score, last_rank, total_score, total_rank = get_scores(
+          cur, user, args.verbose)
+      return EpicastEmails.get_notification(
+          user[0], user[1], last_score, last_rank, total_score, total_rank)
+  elif args.type == 'reminders':
+    def get_email(user):
+      return EpicastEmails.get_reminder(user[0], user[1])
+  else:
+    raise Exception('not implemented')
 
+  #Send the emails
+  # the database cursor isn't thread-safe, so scores are read on this thread
+  # and only the (independent) emailer calls are handed to the pool
+  futures = []
+  concurrency = min(max(1, args.concurrency), MAX_CONCURRENCY)
+  with ThreadPoolExecutor(max_workers=concurrency) as executor:
+    for u in users:
+      user_email = u[2]
+      subject, text, html = get_email(u)
+
+      if args.print:
+        log('%s -> %s\n%s' % (subject, user_email, text), True)
+      else:
+        # smear emails over time by setting a random priority which the
+        # emailer will use to determine email batches
+        priority = random.random()
+        futures.append(executor.submit(
+            emailer_impl.queue_email,
+            to=user_email,
+            subject=subject,
+            text=text,
+            html=html,
+            priority=priority))
+
+  # re-raise the first failure, if any, before sending anything
+  for future in futures:
+    future.result()
+
+  # the emailer sends the whole queue over a single session, so only call it
+  # once
   if not args.print:
     emailer_impl.call_emailer()
 
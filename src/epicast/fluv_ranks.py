@@ -0,0 +1,31 @@
+"""Ranks users by forecast error for Epicast-FLUV scores.
+
+This is kept apart from `fluv_scores`, which connects to the database when it
+is run, so that it can be imported (and tested) on its own. scipy isn't used
+since importing it pulls in the standard library's `secrets`, which collides
+with the local credentials module of the same name.
+"""
+
+# third party
+import numpy as np
+
+
+def rank_min(values):
+  """Rank along the last axis like `scipy.stats.rankdata(method='min')`.
+
+  The smallest value has rank 1, and ties all share the smallest of their
+  ranks.
+  """
+
+  values = np.asarray(values)
+  order = np.argsort(values, axis=-1, kind='stable')
+  ordered = np.take_along_axis(values, order, axis=-1)
+  # each value takes the position of the first value it ties with
+  first_of_tie = np.ones(ordered.shape, dtype=bool)
+  first_of_tie[..., 1:] = ordered[..., 1:] != ordered[..., :-1]
+  positions = np.arange(1, values.shape[-1] + 1)
+  ordered_ranks = np.maximum.accumulate(
+      np.where(first_of_tie, positions, 0), axis=-1)
+  ranks = np.empty_like(ordered_ranks)
+  np.put_along_axis(ranks, order, ordered_ranks, axis=-1)
+  return ranks
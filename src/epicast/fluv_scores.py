@@ -1,30 +1,49 @@
+import argparse
 from delphi_epidata import Epidata
 import mysql.connector
+import numpy as np
 import secrets
 import epiweek as epi_utils
+import fluv_ranks
+
+# Args and usage
+parser = argparse.ArgumentParser()
+parser.add_argument('-v', '--verbose', action='store_const', const=True, default=False, help="show debugging output")
+args = parser.parse_args()
 
 # Connect to epicast2 database
 u, p = secrets.db.epi
-cnx = mysql.connector.connect(user=u, password=p, database='epicast2')
-cur = cnx.cursor(buffered=True)
+cnx = mysql.connector.connect(user=u, password=p, database='epicast2', autocommit=False)
+# unbuffered, so that large result sets are streamed into the arrays below
+# rather than being held in memory alongside them
+cur = cnx.cursor()
 
 
 # Get ground truth
-history = {}
 regions = ["nat","hhs1","hhs2","hhs3","hhs4","hhs5","hhs6","hhs7","hhs8","hhs9","hhs10","ga","pa","dc","tx","or"]
 # for 2017-18 season, 201744 is the first ground truth data we get after the competition starts (i.e., users forecasted for it in 201743)
 #############################################################
 season_start, season_end = 201744, 201820
 
+# every epiweek that can appear in a forecast, mapped to its array index
+season_epiweeks = list(epi_utils.range_epiweeks(season_start-1, season_end, inclusive=True))
+ew_index = {ew: i for (i, ew) in enumerate(season_epiweeks)}
+num_ews = len(season_epiweeks)
+
+# history[r-1, ew_index[epiweek]] is the wILI for region_id r, or nan if not
+# yet available
+history = np.full((len(regions), num_ews), np.nan)
 for r in range(1, len(regions)+1):
-  history[r] = {}
   rows = Epidata.check(Epidata.fluview(regions[r-1], Epidata.range(season_start, season_end)))
   truth = [(row['epiweek'], row['wili']) for row in rows]
   availableWeeks = [row[0] for row in truth]
   for row in truth:
     (epiweek, wili) = row
-    history[r][epiweek] = wili
-    print(regions[r-1], epiweek, wili)
+    history[r-1, ew_index[epiweek]] = wili
+    if args.verbose:
+      print(regions[r-1], epiweek, wili)
+  # one line per region rather than one per week
+  print('loaded %s: %d weeks' % (regions[r-1], len(truth)))
 
 epiweek = availableWeeks[-1]
 print("epiweek", epiweek)
@@ -34,7 +53,7 @@ else: forecast_made = epiweek-1
 # debug print
 print("availableWeeks", availableWeeks)
 expected_weeks = epi_utils.delta_epiweeks(season_start, epiweek) + 1
-num_weeks = len(history[1])
+num_weeks = np.count_nonzero(~np.isnan(history[0]))
 print('loaded history for %d weeks' % (num_weeks))
 # #######################################################
 if num_weeks != expected_weeks:
@@ -43,106 +62,85 @@ if num_weeks != expected_weeks:
 
 # Get all user_id
 cur.execute("select id from ec_fluv_users") # maybe need to investigate more about _debug???
-num_users = 0
-user_ids = []
-for user_id in cur:
-  num_users += 1
-  user_ids.append(user_id[0])
+user_ids = np.fromiter((row[0] for row in cur), dtype=np.int64)
+num_users = user_ids.size
+# user_col[u] is the column of user_id u, or -1 for an unknown id
+user_col = np.full(user_ids.max(initial=0) + 1, -1)
+user_col[user_ids] = np.arange(num_users)
 
 
 # Get the forecasts
-forecast = {}
-for r in range(1, len(regions)+1): 
-  # r is region_id
-  forecast[r] = {}
-  ################################# might need to check this season_end and inclusive_false at the end of the season, season_start-1?
-  for ew1 in epi_utils.range_epiweeks(season_start-1, season_end, inclusive=False):
-    forecast[r][ew1] = {}
-    for ew2 in epi_utils.range_epiweeks(epi_utils.add_epiweeks(ew1, 1), season_end, inclusive=True):
-      forecast[r][ew1][ew2] = {}
-      for user_id in user_ids:
-        forecast[r][ew1][ew2][user_id] = -200
-
-
+# forecast[r-1, ew_index[ew1], ew_index[ew2], user_col[u]] is the wILI that
+# user u predicted in ew1 for ew2, or -200 if there was no prediction; only
+# cells with ew1 < ew2 are meaningful
+forecast = np.full((len(regions), num_ews, num_ews, num_users), -200.0)
+
+# we asked users to forecast 14 regions in week 201743 and 16 regions from
+# 201744; predictions for any other regions are dropped by the database
+# rather than being sent over and discarded here
+# this is a range scan plus join given the following indexes (the schema isn't
+# managed here, so they have to be created on the database by hand):
+#   CREATE INDEX ix_fc_ewnow_ew_reg_user ON ec_fluv_forecast (`epiweek_now`, `epiweek`, `region_id`, `user_id`);
+#   CREATE INDEX ix_fs_user_region_ewnow ON ec_fluv_submissions (`user_id`, `region_id`, `epiweek_now`);
 cur.execute("""
   select f.user_id, f.region_id, f.epiweek_now, f.epiweek, f.wili from ec_fluv_forecast f 
   JOIN ec_fluv_submissions s ON f.user_id = s.user_id AND f.region_id = s.region_id AND
-  f.epiweek_now = s.epiweek_now where f.epiweek_now >= 201743 and f.epiweek <= 201820""")
+  f.epiweek_now = s.epiweek_now where f.epiweek_now >= 201743 and f.epiweek <= 201820 AND
+  ((f.epiweek_now = 201743 AND f.region_id <= %s) OR (f.epiweek_now > 201743 AND f.region_id <= %s))""", (len(regions)-2, 16))
 
 num_predictions = 0
 for (u, r, ew1, ew2, wili) in cur:
-  # we asked users to forecast 14 regions in week 201743 and 16 regions from 201744
-  if ((ew1 == 201743 and r <= len(regions)-2) or (ew1 > 201743 and r <= 16)):  
-  # if ((ew1 == 201743 and r <= len(regions)) or (ew1 > 201743 and r <= 14)):  
-    try:
-      forecast[r][ew1][ew2][u] = wili
-      num_predictions += 1
-    except:
-      # print(u, r, ew1, ew2, wili)
+  try:
+    i1, i2, j = ew_index[ew1], ew_index[ew2], user_col[u]
+    if i1 >= i2 or j < 0:
       raise Exception()
-      pass
+    forecast[r-1, i1, i2, j] = wili
+    num_predictions += 1
+  except:
+    # print(u, r, ew1, ew2, wili)
+    raise Exception()
+    pass
 print('loaded %d predictions for %d users' % (num_predictions, num_users))
 
 
-# rank users in each cell by absolute error
-scores = {}
-print("user_ids in the order of best accuracy to worst accuracy")
-print("i: week during which users submitted input")
-print("j: week for which we have ground truth")
-for r in forecast:
-  scores[r] = {}
-  for ew1 in forecast[r]:
-    scores[r][ew1] = {}
-    for ew2 in forecast[r][ew1]:
-      scores[r][ew1][ew2] = {}
-      ranking = []
-      for u in forecast[r][ew1][ew2]:
-        if ew2 in history[r]:
-          error = abs(forecast[r][ew1][ew2][u] - history[r][ew2])
-          # print("u",u,"r",r,"ew1",ew1,"ew2",ew2,"forecast",forecast[r][ew1][ew2][u],"r",r,"truth",history[r][ew2],"error", error)
-        else:
-          error = 0
-        ranking.append({ 'u': u, 'error': error, 'rank': 0, 'score': 0})
-      ranking = sorted(ranking, key=lambda x: x['error'])
-
-      # debug print
-      if (ew2 == 201745):
-        print(regions[r-1],"i:", ew1, "j:",ew2, [y['u'] for y in ranking])
-
-
-      last_error, last_rank = 0, 1
-      for (i, row) in enumerate(ranking):
-        new_error, new_rank = row['error'], i + 1
-        if new_error == last_error:
-          new_rank, new_error = last_rank, last_error
-        else:
-          last_rank, last_error = new_rank, new_error
-        row['rank'] = new_rank
-        # if (ew2 == 201744):
-          # print("for week 201744,","r",r,"u",row['u'], "rank", row['rank'])
-        row['score'] = 1 / row['rank']
-      for row in ranking:
-        u = row['u']
-        scores[r][ew1][ew2][u] = row
-
-# helper to get scores on a column (different ew1, same ew2) of the score table
-# weekly score is the sum of all (ew1, epiweek) scores
-def get_weekly_score(u, ew2):
-  max_score, min_score = 0, 0
-  user_score = 0
-  for ew1 in epi_utils.range_epiweeks(201743, ew2, inclusive=False):
-    weight = 1 / epi_utils.delta_epiweeks(ew1, ew2)
-    for r in range(1, len(regions)+1):
-      max_score += weight
-      min_score += (1 / num_users) * weight
-      user_score += scores[r][ew1][ew2][u]['score'] * weight
+# absolute error of every prediction; cells without ground truth yet have no
+# error, which ties all users for first place
+error = np.abs(forecast - history[:, np.newaxis, :, np.newaxis])
+error[np.isnan(error)] = 0
+
+# rank users in each cell by absolute error, with ties sharing the best rank
+ranks = fluv_ranks.rank_min(error)
+scores = 1 / ranks
+
+# debug print
+if args.verbose and 201745 in ew_index:
+  print("user_ids in the order of best accuracy to worst accuracy")
+  print("i: week during which users submitted input")
+  print("j: week for which we have ground truth")
+  i2 = ew_index[201745]
+  for r in range(len(regions)):
+    for i1 in range(i2):
+      order = np.argsort(error[r, i1, i2], kind='stable')
+      print(regions[r],"i:", season_epiweeks[i1], "j:",season_epiweeks[i2], user_ids[order].tolist())
+
+# weight[i1, i2] is the weight of a (ew1, ew2) cell in the score for week ew2;
+# since epiweeks are indexed consecutively, the distance between them is just
+# the difference of their indices
+i1, i2 = np.meshgrid(np.arange(num_ews), np.arange(num_ews), indexing='ij')
+weight = np.where(i1 < i2, 1 / np.maximum(i2 - i1, 1), 0)
+
+# weekly score is the sum of all (ew1, epiweek) scores in a column (different
+# ew1, same ew2) of the score table, for all regions and users at once
+user_score = np.einsum('rijk,ij->jk', scores, weight)
+max_score = len(regions) * weight.sum(axis=0)
+min_score = max_score / num_users
+with np.errstate(divide='ignore', invalid='ignore'):
   # normalized
-  score = (user_score - min_score) / (max_score - min_score)
-  # boosted
-  score = 1 - ((1 - score) ** 2)
-  # rescaled
-  score = 500 + 500 * score
-  return score
+  weekly_scores = (user_score - min_score[:, np.newaxis]) / (max_score - min_score)[:, np.newaxis]
+# boosted
+weekly_scores = 1 - ((1 - weekly_scores) ** 2)
+# rescaled
+weekly_scores = 500 + 500 * weekly_scores
 
 # def get_weekly_score(u, ew2):
 #   max_score, min_score = 0, 0
@@ -176,19 +174,22 @@ def get_weekly_score(u, ew2):
 
 
 
+# keep the weekly scores of the weeks that have been scored so far
+season_weeks = list(epi_utils.range_epiweeks(season_start, availableWeeks[-1], inclusive=True))
+weekly_scores = weekly_scores[[ew_index[ew2] for ew2 in season_weeks]]
+
 # calculate total and weekly score for each user
-for u in user_ids:
+rows = []
+for (j, u) in enumerate(user_ids.tolist()):
 
-  user_scores = []
-  # compute weekly scores
-  for ew2 in epi_utils.range_epiweeks(season_start, availableWeeks[-1], inclusive=True):
-    score = get_weekly_score(u, ew2)
-    user_scores.append(score)
-    
+  user_scores = [float(scores_by_user[j]) for scores_by_user in weekly_scores]
 
   # total score and last week's score
   total, last = sum(user_scores), user_scores[-1]
-  print('user %d: total=%.3d last=%.3f' % (u, total, last))
+  if args.verbose:
+    print('user %d: total=%.3d last=%.3f' % (u, total, last))
+  rows.append((u, total, last))
+print('scored %d users over %d weeks' % (len(rows), len(season_weeks)))
 
 
 # for u in user_ids:
@@ -200,11 +201,16 @@ for u in user_ids:
 #   print('user %d: total=%.3d last=%.3f' % (u, total, last))
 
 
-  # Save to database
-  cur.execute("""
-    INSERT INTO ec_fluv_scores (`user_id`, `total`, `last`, `updated`) VALUES(%s, %s, %s, now()) ON DUPLICATE KEY UPDATE `total` = %s, `last` = %s, `updated` = now()
-  """, (u, total, last, total, last))
+# Save to database
+# the update clause refers to VALUES() rather than repeating the parameters,
+# which lets the connector send every row in a single multi-row INSERT;
+# autocommit is off, so this is one transaction, committed below
+write_cur = cnx.cursor()
+write_cur.executemany("""
+  INSERT INTO ec_fluv_scores (`user_id`, `total`, `last`, `updated`) VALUES(%s, %s, %s, now()) ON DUPLICATE KEY UPDATE `total` = VALUES(`total`), `last` = VALUES(`last`), `updated` = now()
+""", rows)
 
 cnx.commit()
+write_cur.close()
 cur.close()
 cnx.close()
@@ -41,6 +41,7 @@ Performs database updates for Epicast-FLUV:
 
 # standard library
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 
 # third party
 import mysql.connector
@@ -79,6 +80,18 @@ def check(res):
     raise Exception('API failure (%d|%s)' % (res['result'], res['message']))
   return res['epidata']
 
+def get_history(region_labels):
+  # fetch all regions in a single request
+  epiweeks = Epidata.range(199740, 203001)
+  res = Epidata.fluview(region_labels, epiweeks)
+  if res['result'] == 1:
+    return res['epidata']
+  # the combined request was refused or truncated, so fall back to one request
+  # per region, issued concurrently
+  with ThreadPoolExecutor(max_workers=len(region_labels)) as executor:
+    results = executor.map(lambda r: check(Epidata.fluview(r, epiweeks)), region_labels)
+    return [row for rows in results for row in rows]
+
 
 def main():
   # DB stuff
@@ -109,11 +122,13 @@ def main():
       # Generate the new data table and do the swap
       execute_sql(cur, 'UPDATE ec_fluv_round SET `data_epiweek` = %d' % epiweek_new)
       execute_sql(cur, 'TRUNCATE TABLE ec_fluv_history_stage')
-      for (region_id, region_label) in zip([i for i in range(1, 12)], ['nat'] + ['hhs%d' % r for r in range(1, 11)]):
-        print(' Updating %s...' % region_label)
-        if args.test: continue
-        for row in check(Epidata.fluview(region_label, Epidata.range(199740, 203001))):
-          cur.execute('INSERT INTO ec_fluv_history_stage (`region_id`, `epiweek`, `wili`) VALUES (%s, %s, %s)', (region_id, row['epiweek'], row['wili']))
+      region_labels = ['nat'] + ['hhs%d' % r for r in range(1, 11)]
+      region_ids = dict(zip(region_labels, range(1, 12)))
+      print(' Updating %s...' % ', '.join(region_labels))
+      if not args.test:
+        rows = get_history(region_labels)
+        batch = [(region_ids[row['region']], row['epiweek'], row['wili']) for row in rows]
+        cur.executemany('INSERT INTO ec_fluv_history_stage (`region_id`, `epiweek`, `wili`) VALUES (%s, %s, %s)', batch)
       execute_sql(cur, 'ALTER TABLE ec_fluv_history RENAME TO ec_fluv_history_temp')
       execute_sql(cur, 'ALTER TABLE ec_fluv_history_stage RENAME TO ec_fluv_history')
       execute_sql(cur, 'ALTER TABLE ec_fluv_history_temp RENAME TO ec_fluv_history_stage')
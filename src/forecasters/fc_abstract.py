@@ -23,6 +23,7 @@ The abstract base class of all forecasting systems.
 # standard library
 import abc
 from datetime import datetime
+import functools
 import math
 from statistics import median_low
 
@@ -114,6 +115,70 @@ class Targets:
     }
     return targets
 
+  @staticmethod
+  def round_wili(curves):
+    """ element-wise `round(w, 1)`, including Python's handling of ties """
+    curves = np.asarray(curves, dtype=float)
+    rounded = np.round(curves, 1)
+    # `np.round` scales by 10 before rounding, which can disagree with Python's
+    # exact decimal rounding when a value is (almost) halfway between tenths
+    scaled = curves * 10
+    near_tie = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    # `tolist` gives Python floats; `round` on `np.float64` would round half to
+    # even instead
+    rounded[near_tie] = [round(w, 1) for w in curves[near_tie].tolist()]
+    return rounded
+
+  @staticmethod
+  def get_all_targets_batch(curves, baseline, current_index, rule_season=None):
+    """
+    dictionary of all targets, each a list with one value per curve
+
+    Equivalent to calling `get_all_targets` on each row of `curves`, but
+    computed for all curves at once. Single precision curves are kept as they
+    are; only rounding is done in double precision.
+    """
+    curves = np.asarray(curves)
+    if len(curves) == 0:
+      # no curves at all (e.g. Epicast without any submissions)
+      names = ['onset', 'peakweek', 'peak', 'x1', 'x2', 'x3', 'x4']
+      return dict((name, []) for name in names)
+    if not np.issubdtype(curves.dtype, np.floating):
+      curves = curves.astype(float)
+    num_curves, num_weeks = curves.shape
+    rounded = Targets.round_wili(curves)
+    rows = np.arange(num_curves)
+
+    # onset: the first of three consecutive weeks at or above baseline
+    if baseline is None:
+      onsets = [None] * num_curves
+      has_onset = np.zeros(num_curves, dtype=bool)
+    else:
+      above = rounded >= baseline
+      runs = above[:, :-2] & above[:, 1:-1] & above[:, 2:]
+      has_onset = runs.any(axis=1)
+      first_run = np.argmax(runs, axis=1) if runs.size else rows * 0
+      onsets = [int(i) if ok else None for (i, ok) in zip(first_run, has_onset)]
+
+    # peakweek: median-low of the weeks at the (rounded) peak
+    is_peak = rounded == rounded.max(axis=1, keepdims=True)
+    median_rank = (is_peak.sum(axis=1) - 1) // 2 + 1
+    peakweeks = np.argmax(np.cumsum(is_peak, axis=1) >= median_rank[:, None], axis=1)
+    if rule_season is not None and rule_season < 2016:
+      peakweeks = [int(i) if ok else None for (i, ok) in zip(peakweeks, has_onset)]
+    else:
+      peakweeks = [int(i) for i in peakweeks]
+
+    targets = {
+      'onset': onsets,
+      'peakweek': peakweeks,
+      'peak': curves.max(axis=1).tolist(),
+    }
+    for ahead in range(1, 5):
+      index = min(current_index + ahead, num_weeks - 1)
+      targets['x%d' % ahead] = curves[:, index].tolist()
+    return targets
+
 
 class Forecaster(abc.ABC):
 
@@ -135,7 +200,9 @@ class Forecaster(abc.ABC):
       return uniform * weight + np.array(dist) * (1 - weight)
 
     @staticmethod
-    def smooth(curve, bandwidth):
+    @functools.lru_cache(maxsize=16)
+    def get_kernel(bandwidth):
+      """ discrete Gaussian kernel (cached; read-only) """
       cdf = stats.norm(0, bandwidth).cdf
       prob = lambda i: cdf(i + 0.5) - cdf(i - 0.5)
       num = 1
@@ -143,6 +210,13 @@ class Forecaster(abc.ABC):
         num += 2
       window = num * 2 + 1
       kernel = np.array([prob(i - window // 2) for i in range(window)])
+      kernel.setflags(write=False)
+      return kernel
+
+    @staticmethod
+    def smooth(curve, bandwidth):
+      kernel = Forecaster.Utils.get_kernel(bandwidth)
+      window = len(kernel)
       temp = np.convolve(curve, kernel, 'full')
       i = window // 2
       j = -(i + 1)
@@ -151,23 +225,32 @@ class Forecaster(abc.ABC):
       smoothed = temp[i:j + 1]
       return smoothed
 
+    @staticmethod
+    def finalize(counts, smooth_bw, uniform_weight):
+      """ normalize, optionally smooth, then blend with uniform, in one buffer """
+      dist = np.array(counts, dtype=float)
+      dist /= dist.sum()
+      if smooth_bw > 0:
+        dist = Forecaster.Utils.smooth(dist, smooth_bw)
+      dist *= 1 - uniform_weight
+      dist += uniform_weight / len(dist)
+      return dist
+
     @staticmethod
     def get_week_forecast(first_epiweek, num_bins, indices, uniform_weight, smooth_bw, allow_none):
-      dist = [indices.count(i) for i in range(num_bins)]
-      none = indices.count(None)
+      possibilities = [i for i in indices if i is not None]
+      none = len(indices) - len(possibilities)
       if none > 0 and not allow_none:
         raise Exception('target does not allow None, but None was provided')
-      extra = [none] if allow_none else []
-      temp = Forecaster.Utils.normalize(np.array(dist + extra))
-      if smooth_bw > 0:
-        # TODO: don't smooth across dist and norm
-        temp = Forecaster.Utils.smooth(temp, smooth_bw)
-      temp = Forecaster.Utils.blend(temp, uniform_weight)
+      dist = np.bincount(np.array(possibilities, dtype=int), minlength=num_bins)[:num_bins]
+      if allow_none:
+        dist = np.append(dist, none)
+      # TODO: don't smooth across dist and norm
+      temp = Forecaster.Utils.finalize(dist, smooth_bw, uniform_weight)
       if allow_none:
         dist, none = temp[:-1], temp[-1]
       else:
         dist, none = temp, None
-      possibilities = [i for i in indices if i is not None]
       if len(possibilities) == 0:
         possibilities = [0]
       point = flu.add_epiweeks(first_epiweek, int(median_low(possibilities)))
@@ -175,15 +258,10 @@ class Forecaster(abc.ABC):
 
     @staticmethod
     def get_wili_forecast(bin_size, num_bins, wili, uniform_weight, smooth_bw):
-      limit = lambda i: i * bin_size if i < num_bins else float('inf')
-      dist = []
-      for i in range(num_bins):
-        a, b = limit(i), limit(i + 1)
-        dist.append(sum(a <= w < b for w in wili))
-      dist = Forecaster.Utils.normalize(np.array(dist))
-      if smooth_bw > 0:
-        dist = Forecaster.Utils.smooth(dist, smooth_bw)
-      dist = Forecaster.Utils.blend(dist, uniform_weight)
+      # bins are [i * bin_size, (i + 1) * bin_size), the last one unbounded
+      edges = np.append(np.arange(num_bins) * bin_size, np.inf)
+      dist, _ = np.histogram(wili, bins=edges)
+      dist = Forecaster.Utils.finalize(dist, smooth_bw, uniform_weight)
       point = np.median(wili)
       return (dist, point)
 
@@ -193,7 +271,36 @@ class Forecaster(abc.ABC):
 
     @staticmethod
     def sample_normal_var(mean, var, num):
-      return Forecaster.Utils.sample_normal_cov(mean, np.diag(var), num)
+      return Forecaster.Utils.sample_normal_diag(mean, var, num)
+
+    @staticmethod
+    def sample_normal_diag(mean, var, num):
+      """
+      like `sample_normal_cov` with a diagonal covariance, without forming it
+
+      Curves are drawn in single precision, which is plenty for wILI and halves
+      the memory of the samples. The generator is seeded from the global state
+      so that `numpy.random.seed` still makes the draws reproducible.
+
+      Weeks with zero variance are copied exactly from `mean` instead, since
+      e.g. 2.35 in single precision would fall into the 2.3 bin. When there are
+      any such weeks, the curves are returned in double precision.
+      """
+      mean = np.asarray(mean, dtype=float)
+      var = np.asarray(var, dtype=float)
+      pinned = var == 0
+      std = np.sqrt(var[~pinned]).astype(np.float32)
+      rng = random.default_rng(random.randint(2 ** 31))
+      draws = rng.standard_normal((num, len(std)), dtype=np.float32)
+      draws *= std
+      draws += mean[~pinned].astype(np.float32)
+      np.fmax(draws, 0, out=draws)
+      if not np.any(pinned):
+        return draws
+      curves = np.empty((num, len(var)))
+      curves[:, ~pinned] = draws
+      curves[:, pinned] = np.fmax(mean[pinned], 0)
+      return curves
 
     @staticmethod
     def sample_normal_cov(mean, cov, num):
@@ -294,14 +401,14 @@ class Forecaster(abc.ABC):
         baseline = None
 
       # get all targets
-      targets = [Targets.get_all_targets(c, baseline, offset, rule_season=self.test_season) for c in curves]
-      onsets = [t['onset'] for t in targets]
-      peakweeks = [t['peakweek'] for t in targets]
-      peaks = [t['peak'] for t in targets]
-      x1s = [t['x1'] for t in targets]
-      x2s = [t['x2'] for t in targets]
-      x3s = [t['x3'] for t in targets]
-      x4s = [t['x4'] for t in targets]
+      targets = Targets.get_all_targets_batch(curves, baseline, offset, rule_season=self.test_season)
+      onsets = targets['onset']
+      peakweeks = targets['peakweek']
+      peaks = targets['peak']
+      x1s = targets['x1']
+      x2s = targets['x2']
+      x3s = targets['x3']
+      x4s = targets['x4']
 
       # forecast each target
       allow_no_pw = self.test_season < 2016
@@ -70,19 +70,24 @@ class Baseline(Forecaster):
       # print("range_epiweeks: ", [i for i in flu.range_epiweeks(ew1, ew2)])
       curve = [stable[ew] for ew in flu.range_epiweeks(ew1, ew2)]
       curves.append(curve)
-    self.emp_mean[region] = np.mean(curves, axis=0)
-    self.emp_var[region] = np.var(curves, axis=0, ddof=1)
+    curves = np.array(curves, dtype=float)
+    self.emp_mean[region] = curves.mean(axis=0)
+    self.emp_var[region] = curves.var(axis=0, ddof=1)
     self.emp_curves[region] = curves
     if self.backfill_weeks is None:
       self.bf_var[region] = [0]
     else:
-      self.bf_var[region] = []
+      # changes[lag, i] is the revision of the i-th stable value since it was
+      # first reported `lag` weeks after the fact, or nan if it wasn't
+      epiweeks = sorted(stable.keys())
+      stable_values = np.array([stable[ew] for ew in epiweeks], dtype=float)
+      changes = np.full((self.backfill_weeks, len(epiweeks)), np.nan)
       for lag in range(self.backfill_weeks):
         unstable = self._get_unstable(region, lag)
-        changes = [stable[ew] - unstable[ew] for ew in stable.keys() & unstable.keys()]
-        if len(changes) < 2:
-          raise Exception('not enough data')
-        self.bf_var[region].append(np.var(changes, ddof=1))
+        changes[lag] = stable_values - [unstable.get(ew, np.nan) for ew in epiweeks]
+      if np.any(np.count_nonzero(~np.isnan(changes), axis=1) < 2):
+        raise Exception('not enough data')
+      self.bf_var[region] = list(np.nanvar(changes, axis=1, ddof=1))
     print(' %5s: %s' % (region, ' '.join(['%.3f' % (b ** 0.5) for b in self.bf_var[region]])))
 
   def _forecast(self, region, epiweek):
@@ -93,14 +98,17 @@ class Baseline(Forecaster):
     observed = self._get_current(region, epiweek, self.forecast_type)
 
     mean, var = self.emp_mean[region].copy(), self.emp_var[region].copy()
-    for ew in flu.range_epiweeks(ew1, flu.add_epiweeks(epiweek, 1)):
-      i = flu.delta_epiweeks(ew1, ew)
-      lag = flu.delta_epiweeks(ew1, epiweek) - i
-      lag = min(lag, len(self.bf_var[region]) - 1)
-      mean[i] = observed[i]
-      var[i] = self.bf_var[region][lag]
+    # weeks observed so far are pinned to the data, with backfill variance
+    # depending on how many weeks ago they were (capped at the last lag)
+    num_observed = flu.delta_epiweeks(ew1, epiweek) + 1
+    lags = np.arange(num_observed - 1, -1, -1)
+    lags = np.minimum(lags, len(self.bf_var[region]) - 1)
+    mean[:num_observed] = observed[:num_observed]
+    var[:num_observed] = np.array(self.bf_var[region])[lags]
     curves = Forecaster.Utils.sample_normal_var(mean, var, self.num_samples)
     if not self.do_sampling:
+      # the empirical curves are copied exactly, not in single precision
+      curves = curves.astype(float)
       offset = flu.delta_epiweeks(ew1, epiweek) + 1
       for (i, curve) in enumerate(curves):
         index = i % len(self.emp_curves[region])
@@ -17,12 +17,36 @@ future (including the current week).
   + First version
 """
 
+# standard library
+import functools
+
+# third party
+import numpy as np
+
 # first party
 from .fc_abstract import Forecaster
 import delphi.utils.epiweek as flu
 from ..utils.forecast_type import ForecastType
 
 
+@functools.lru_cache(maxsize=None)
+def _split_index(test_season, epiweek):
+  """ index of `epiweek` in the season, where the past and future curves meet """
+  return flu.delta_epiweeks(flu.join_epiweek(test_season, 40), epiweek)
+
+
+def _join_curves(past, future, index):
+  """ join past curves before `index` with future curves from `index` on """
+  past, future = np.asarray(past), np.asarray(future)
+  if len(past) == 0 or len(future) == 0:
+    # nothing to join (e.g. Epicast without any submissions)
+    return []
+  # the shorter set of curves is cycled to the length of the longer one
+  rows = np.arange(max(len(past), len(future)))
+  past, future = past[rows % len(past)], future[rows % len(future)]
+  return np.concatenate((past[:, :index], future[:, index:]), axis=1)
+
+
 class Hybrid(Forecaster):
 
   def __init__(self, name, past, future, forecast_type):
@@ -43,15 +67,10 @@ class Hybrid(Forecaster):
     self.future.close()
 
   def _forecast(self, region, epiweek):
-    print('inside hybrid._forecast, region, epiweek:', region, epiweek)
     P = self.past._forecast(region, epiweek)
     F = self.future._forecast(region, epiweek)
-    print('inside hybrid._forecast, len P, len F', len(P), len(F))
-    i = flu.delta_epiweeks(flu.join_epiweek(self.test_season, 40), epiweek)
-    curves = []
-    for j in range(max(len(P), len(F))):
-      p, f = P[j % len(P)], F[j % len(F)]
-      curves.append(list(p[:i]) + list(f[i:]))
+    i = _split_index(self.test_season, epiweek)
+    curves = _join_curves(P, F, i)
     if self._callback is not None:
       self._callback()
     return curves
@@ -1,14 +1,14 @@
 # all locations we can query
-STATE_LIST = [
+STATE_LIST = (
               'ga', 'or',
             #   'md', 'mi', 'mn', 
             #   'nm',  
             #   'oh', 'or', 
             #   'tn', 'ut',
-              'network_all']
+              'network_all')
 # descriptions for age groups 0-4
-GROUP_DESCRIPTIONS = ['Ages 0-4', 'Ages 5-17', 'Ages 18-49', 
-                    'Ages 50-64', 'Ages 65+']
+GROUP_DESCRIPTIONS = ('Ages 0-4', 'Ages 5-17', 'Ages 18-49', 
+                    'Ages 50-64', 'Ages 65+')
 
 # hyperparameters for machine learning models
 RIDGE_ALPHA = 0.5
@@ -20,3 +20,5 @@ EPS = 0.05
 FIRST_YEAR, YEAR_WINDOW = 2012, 1
 # hyperparameters for prediction
 PENALTY = 0.03
+# resolution of the per-window plots written during nowcast experiments
+SWEEP_DPI = 100
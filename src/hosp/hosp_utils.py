@@ -1,9 +1,71 @@
 """
 utilities for hospitalization data analysis.
 """
+# standard library
+from functools import lru_cache
+# third party
+import numpy as np
 # first party
 import utils.epiweek as utils
+from flu_contest.src.hosp.constants import STATE_LIST, GROUP_DESCRIPTIONS
 
+@lru_cache(maxsize=None)
+def _weeks_in_year(year):
+    """
+    the number of epiweeks (52 or 53) in a year, computed once per year.
+    """
+    return utils.delta_epiweeks(utils.join_epiweek(year, 1),
+                                utils.join_epiweek(year + 1, 1))
+
+def _add_epiweeks(epiweek, weeks):
+    """
+    same as utils.add_epiweeks, but with integer arithmetic only.
+    """
+    year, week = utils.split_epiweek(epiweek)
+    week += weeks
+    while week > _weeks_in_year(year):
+        week -= _weeks_in_year(year)
+        year += 1
+    while week < 1:
+        year -= 1
+        week += _weeks_in_year(year)
+    return utils.join_epiweek(year, week)
+
+def _delta_epiweeks(epiweek1, epiweek2):
+    """
+    same as utils.delta_epiweeks, but with integer arithmetic only.
+    """
+    year1, week1 = utils.split_epiweek(epiweek1)
+    year2, week2 = utils.split_epiweek(epiweek2)
+    if year1 > year2:
+        return -_delta_epiweeks(epiweek2, epiweek1)
+    weeks = sum(_weeks_in_year(year) for year in range(year1, year2))
+    return weeks + week2 - week1
+
+def get_window_array(epiweek, left_window, right_window):
+    """
+    compute a time period [epiweek-left_window, epiweek+right_window]
+
+    Args:
+        epiweek - the "central" epiweek for a period
+        left_window - the length of "left side"
+        right_window - the length of "right side"
+    
+    Returns:
+        An array of epiweeks within the period
+    """
+    year, week = utils.split_epiweek(_add_epiweeks(epiweek, -left_window))
+    weeks = week + np.arange(left_window + right_window + 1)
+    years = np.full(weeks.shape, year)
+    # roll the weeks past the end of each year over into the next year
+    while weeks[-1] > _weeks_in_year(year):
+        over = (years == year) & (weeks > _weeks_in_year(year))
+        weeks[over] -= _weeks_in_year(year)
+        years[over] += 1
+        year += 1
+    return years * 100 + weeks
+
+@lru_cache(maxsize=None)
 def get_window(epiweek, left_window, right_window):
     """
     generate a time period [epiweek-left_window, epiweek+right_window]
@@ -14,12 +76,11 @@ def get_window(epiweek, left_window, right_window):
         right_window - the length of "right side"
     
     Returns:
-        A generator of epiweeks within the period
+        A tuple of epiweeks within the period
     """
-    start = utils.add_epiweeks(epiweek, -left_window)
-    end = utils.add_epiweeks(epiweek, right_window)
-    return utils.range_epiweeks(start, end, inclusive=True)
+    return tuple(get_window_array(epiweek, left_window, right_window).tolist())
 
+@lru_cache(maxsize=None)
 def get_start_year(epiweek):
     """ 
     return the starting and ending year of the flu season for an epiweek.
@@ -31,11 +92,11 @@ def get_start_year(epiweek):
         the starting year of the season
     """
     year, week = utils.split_epiweek(epiweek)
-    if week <= 20:
-        return year - 1
-    elif week >= 40:
-        return year
+    if 20 < week < 40:
+        raise Exception('epiweek %d is outside of the flu season' % epiweek)
+    return year - (week <= 20)
 
+@lru_cache(maxsize=None)
 def get_period(year, start_week, end_week):
     """
     return the corresponding period for a starting year, 
@@ -60,6 +121,26 @@ def get_period(year, start_week, end_week):
         return utils.join_epiweek(year, start_week), \
             utils.join_epiweek(year + 1, end_week)
 
+def get_period_batch(years, start_weeks, end_weeks):
+    """
+    same as get_period, for arrays of starting years, starting weeks,
+    and ending weeks at once.
+
+    Args:
+        years - the start years for the seasons.
+        start_weeks - the starting weeks within the seasons.
+        end_weeks - the ending weeks within the seasons.
+
+    Returns:
+        arrays of the starting and ending epiweeks of the periods.
+    """
+    years, start_weeks, end_weeks = np.broadcast_arrays(years, start_weeks, end_weeks)
+    in_order = start_weeks <= end_weeks
+    start_years = np.where(in_order & (end_weeks <= 30), years + 1, years)
+    end_years = np.where(in_order, start_years, years + 1)
+    return start_years * 100 + start_weeks, end_years * 100 + end_weeks
+
+@lru_cache(maxsize=None)
 def get_max_window(epiweek):
     """
     obtain the maximum window applicable for an epiweek.
@@ -72,18 +153,34 @@ def get_max_window(epiweek):
     """
     start_year = get_start_year(epiweek)
     start_week = utils.join_epiweek(start_year, 40)
-    max_window = utils.delta_epiweeks(start_week, epiweek)
+    max_window = _delta_epiweeks(start_week, epiweek)
 
     return max_window
 
+@lru_cache(maxsize=None)
 def unravel(time_period):
     """
-    convert string representation of a time period to a epiweek generator.
+    convert a time period to a sequence of epiweeks.
+
+    Args:
+        time_period - the starting and ending epiweek, as a tuple
+
+    Returns:
+        A tuple of epiweeks within the period, which can be iterated
+        more than once
+    """
+    start, end = time_period
+    return tuple(utils.range_epiweeks(start, end, inclusive=True))
+
+def get_season(time_period):
+    """
+    return the starting and ending year of a time period.
 
     Args:
-        time_period - the string representation of time period
+        time_period - the starting and ending epiweek, as a tuple
 
     Returns:
-        A generator of epiweeks within the period
+        the starting and ending year of the period
     """
-    return utils.range_epiweeks(time_period[0], time_period[1], inclusive=True)
+    start, end = time_period
+    return utils.split_epiweek(start)[0], utils.split_epiweek(end)[0]
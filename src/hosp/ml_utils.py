@@ -3,14 +3,125 @@ from flu_contest.src.hosp.constants import *
 # third party
 from abc import abstractmethod
 
-from sklearn.linear_model import LinearRegression, Ridge
-from sklearn.ensemble import GradientBoostingRegressor
-
-import bootstrapped.bootstrap as bs
-import bootstrapped.stats_functions as stat_f
+from sklearn.ensemble import HistGradientBoostingRegressor
 
 import cvxopt as cvx
 import numpy as np
+import scipy.sparse as sparse
+from scipy.optimize import linprog
+
+def bootstrap_mean(values, alpha, num_iterations=10000):
+    """
+    bootstrap a confidence interval for the mean of values.
+
+    the resampled means are computed a batch of iterations at a time,
+    and the interval is pivotal (as in the bootstrapped package).
+
+    Args:
+        values - the samples.
+        alpha - the significance level of the interval.
+        num_iterations - the number of bootstrap resamples.
+
+    Returns:
+        the lower and upper bound of the interval.
+    """
+    values = np.asarray(values).ravel()
+    num_values = len(values)
+    # bound the size of each batch of resamples to about a million values
+    batch_size = max(1, 2 ** 20 // num_values)
+    means = np.empty(num_iterations)
+    for start in range(0, num_iterations, batch_size):
+        stop = min(start + batch_size, num_iterations)
+        indices = np.random.randint(0, num_values, (stop - start, num_values))
+        means[start:stop] = values[indices].mean(axis=1)
+    mean = values.mean()
+    lower, upper = np.percentile(means, [100 * alpha / 2, 100 * (1 - alpha / 2)])
+    return 2 * mean - upper, 2 * mean - lower
+
+def r2_score(y_true, y_pred):
+    """
+    the coefficient of determination of predictions, the same as sklearn's
+    metrics.r2_score for 1-d arrays, without its input validation.
+
+    Args:
+        y_true - the true values.
+        y_pred - the predicted values.
+
+    Returns:
+        the r2 score, or nan for fewer than two samples.
+    """
+    if len(y_true) < 2:
+        return np.nan
+    ss_res = np.sum((y_true - y_pred) ** 2)
+    ss_tot = np.sum((y_true - np.mean(y_true)) ** 2)
+    # constant true values, scored the same way as sklearn
+    if ss_tot == 0:
+        return 1.0 if ss_res == 0 else 0.0
+    return 1 - ss_res / ss_tot
+
+def mean_squared_error(y_true, y_pred):
+    """
+    the mean squared error of predictions, the same as sklearn's
+    metrics.mean_squared_error for 1-d arrays.
+
+    Args:
+        y_true - the true values.
+        y_pred - the predicted values.
+
+    Returns:
+        the mean squared error.
+    """
+    return np.mean((y_true - y_pred) ** 2)
+
+class LeastSquares(object):
+    """
+    least squares with an intercept, computed directly with numpy; the 
+    same fit as sklearn's LinearRegression (or Ridge, for a positive 
+    alpha), without their per-call input validation.
+    """
+
+    def __init__(self, alpha=0.0):
+        self.alpha = alpha
+        self.coef_ = None
+        self.intercept_ = None
+
+    def fit(self, X, y):
+        """
+        fit the coefficients and intercept.
+
+        Args:
+            X - training input
+            y - training target
+        
+        Returns:
+            self
+        """
+        # center the data, so that the intercept is not penalized by the
+        # ridge penalty or the minimum-norm solution of rank-deficient problems
+        X_mean, y_mean = X.mean(axis=0), y.mean(axis=0)
+        X_centered, y_centered = X - X_mean, y - y_mean
+
+        if self.alpha > 0:
+            # normal equations with the penalty added to the diagonal
+            A = np.dot(X_centered.T, X_centered)
+            A.flat[::A.shape[0] + 1] += self.alpha
+            self.coef_ = np.linalg.solve(A, np.dot(X_centered.T, y_centered))
+        else:
+            self.coef_ = np.linalg.lstsq(X_centered, y_centered, rcond=None)[0]
+        self.intercept_ = y_mean - np.dot(X_mean, self.coef_)
+        return self
+
+    def predict(self, X):
+        """
+        perform prediction for testing data.
+
+        Args:
+            X - testing data.
+        
+        Returns:
+            predicted values.
+        """
+        return np.dot(X, self.coef_) + self.intercept_
 
 class RegModel(object):
     """
@@ -22,24 +133,32 @@ class RegModel(object):
         self.res = None
         self.model = None
     
-    def _get_quantile(self, residuals):
+    def _get_sig_level(self):
+        """
+        get the significance level to do bootstrapping.
+        """
+        return (1 - max(1 - self.quantile, self.quantile)) * 2
+
+    def _get_quantile(self, residuals, interval=None):
         """
         get quantile from training residuals.
 
         Args:
             residuals - the training residuals.
+            interval - the bootstrapped interval at the model's significance 
+                level, if it is already known.
 
         Returns:
             the specific quantile of mean residuals.
         """
-        # obtain significance level to do bootstrapping
-        sig_level = (1 - max(1 - self.quantile, self.quantile)) * 2
-        interval = bs.bootstrap(residuals, stat_f.mean, alpha=sig_level)
+        if interval is None:
+            interval = bootstrap_mean(residuals, self._get_sig_level())
+        lower_bound, upper_bound = interval
 
         if self.quantile >= 0.5:
-            return interval.upper_bound
+            return upper_bound
         else:
-            return interval.lower_bound
+            return lower_bound
     
     def fit(self, X, y):
         """
@@ -56,6 +175,33 @@ class RegModel(object):
         train_res = y - self.model.predict(X)
         # bootstrap from training residuals
         self.res = self._get_quantile(train_res)
+
+    @staticmethod
+    def fit_interval(upper_model, mid_model, lower_model, X, y):
+        """
+        fit the models of a prediction interval, which only differ by
+        quantile: the regression is trained once and shared, and each 
+        significance level is bootstrapped once.
+
+        Args:
+            upper_model, mid_model, lower_model - regression models of the
+                same type
+            X - training input
+            y - training target
+
+        Returns:
+            None
+        """
+        mid_model.model.fit(X, y)
+        train_res = y - mid_model.model.predict(X)
+        intervals = {}
+
+        for model in (upper_model, mid_model, lower_model):
+            model.model = mid_model.model
+            sig_level = model._get_sig_level()
+            if sig_level not in intervals:
+                intervals[sig_level] = bootstrap_mean(train_res, sig_level)
+            model.res = model._get_quantile(train_res, intervals[sig_level])
     
     def predict(self, X):
         """
@@ -76,7 +222,7 @@ class RegLinear(RegModel):
 
     def __init__(self, quantile):
         super().__init__(quantile)
-        self.model = LinearRegression()
+        self.model = LeastSquares()
 
 class RegRidge(RegModel):
     """
@@ -85,7 +231,7 @@ class RegRidge(RegModel):
 
     def __init__(self, quantile):
         super().__init__(quantile)
-        self.model = Ridge(alpha=RIDGE_ALPHA)
+        self.model = LeastSquares(alpha=RIDGE_ALPHA)
 
 class RegGBDT(RegModel):
     """
@@ -94,8 +240,12 @@ class RegGBDT(RegModel):
 
     def __init__(self, quantile):
         super().__init__(quantile)
-        self.model = GradientBoostingRegressor(loss='ls', n_estimators=ESTIMATIORS, 
-                                                max_depth=DEPTH)
+        # histogram-based boosting, with a fixed number of iterations and trees
+        # as unconstrained as GradientBoostingRegressor's (one sample per leaf,
+        # no limit on the number of leaves)
+        self.model = HistGradientBoostingRegressor(loss='squared_error', max_iter=ESTIMATIORS, 
+                                                max_depth=DEPTH, min_samples_leaf=1,
+                                                max_leaf_nodes=None, early_stopping=False)
 
 class QuantModel(object):
     """
@@ -107,24 +257,44 @@ class QuantModel(object):
         self.beta_0 = None
         self.weight = (1 - quantile) / quantile
 
-    def _get_matrices(self, X, y):
+    @staticmethod
+    def _get_base_matrix(X):
+        """
+        create the part of the inequality matrices shared by all quantiles,
+        i.e. the training input with a column of ones for the intercept.
+
+        Args:
+            X - training input
+        
+        Returns:
+            the sparse training input with intercept column.
+        """
+        # the solvers only work with doubles, and would otherwise copy integer
+        # or non-contiguous inputs into new matrices
+        X = np.ascontiguousarray(X, dtype=float)
+        return sparse.csr_matrix(np.hstack((X, np.ones((len(X), 1)))))
+
+    def _get_matrices(self, X, y, base=None):
         """
         create inequality matrices for a model to solve linear programs.
 
         Args:
             X - training input
             y - training output
+            base - the result of _get_base_matrix for X, if it is already known
         
         Returns:
-            c, G, h - matrices of constraints.
+            c, G, h - matrices of constraints, G as a sparse matrix.
         """
-        n, p = X.shape
-        c = np.concatenate((np.zeros(p + 1), np.ones(n)), axis=0)
+        if base is None:
+            base = QuantModel._get_base_matrix(X)
+        y = np.ascontiguousarray(y, dtype=float)
+        n, p = base.shape[0], base.shape[1] - 1
+        c = np.zeros(p + 1 + n)
+        c[p + 1:] = 1
 
-        G_upper = np.concatenate((self.weight * X, self.weight * np.ones((n, 1)), 
-                                -np.eye(n)), axis=1)
-        G_lower = np.concatenate((-X, -np.ones((n, 1)), -np.eye(n)), axis=1)
-        G = np.concatenate((G_upper, G_lower), axis=0)
+        G = sparse.bmat([[self.weight * base, -sparse.eye(n)],
+                        [-base, -sparse.eye(n)]])
 
         h = np.concatenate((self.weight * y, -y), axis=0)
 
@@ -142,36 +312,32 @@ class QuantModel(object):
             y_train - training target.
         
         Returns:
-            c, G, h - constraint matrices 
+            c, G, h - constraint matrices, G as a sparse matrix
         """
         n_train, p = X_train.shape
 
-        # set up a few building blocks
-        train_zero_mat = np.zeros((2 * n_train, n_train + p + 1))
-        test_mat = np.eye(p + 1)
-        test_small_zero_mat = np.zeros((p + 1, n_train))
-        test_large_zero_mat = np.zeros((p + 1, n_train + p + 1))
-        # fetch and expand constraints for each model
-        upper_c, upper_G, upper_h = upper_model._get_matrices(X_train, y_train)
-        mid_c, mid_G, mid_h = mid_model._get_matrices(X_train, y_train)
-        lower_c, lower_G, lower_h = lower_model._get_matrices(X_train, y_train)
- 
-        upper_G = np.concatenate((upper_G, train_zero_mat, train_zero_mat), axis=1)
-        mid_G = np.concatenate((train_zero_mat, mid_G, train_zero_mat), axis=1)
-        lower_G = np.concatenate((train_zero_mat, train_zero_mat, lower_G), axis=1)
-        # create co-training constraint matrices
-        upper_test_mat = np.concatenate((-test_mat, test_small_zero_mat,
-                                        test_mat, test_small_zero_mat,
-                                        test_large_zero_mat), axis=1)
-        lower_test_mat = np.concatenate((test_large_zero_mat,
-                                        -test_mat, -test_small_zero_mat,
-                                        test_mat, test_small_zero_mat), axis=1)
+        # set up a few building blocks (None blocks are all zeros)
+        test_mat = sparse.eye(p + 1)
+        test_small_zero_mat = sparse.coo_matrix((p + 1, n_train))
+        # fetch and expand constraints for each model, where the models 
+        # share one sparse copy of the training input
+        base = QuantModel._get_base_matrix(X_train)
+        upper_c, upper_G, upper_h = upper_model._get_matrices(X_train, y_train, base)
+        mid_c, mid_G, mid_h = mid_model._get_matrices(X_train, y_train, base)
+        lower_c, lower_G, lower_h = lower_model._get_matrices(X_train, y_train, base)
+        # create co-training constraint blocks; the upper/mid and mid/lower
+        # constraints use the same blocks, shifted by one model
+        neg_test_mat = sparse.hstack((-test_mat, test_small_zero_mat))
+        pos_test_mat = sparse.hstack((test_mat, test_small_zero_mat))
         # concatenate all constraints
         c = np.concatenate((upper_c, mid_c, lower_c), axis=0)
-        G = np.concatenate((upper_G, mid_G, lower_G, upper_test_mat, lower_test_mat), axis=0)
+        G = sparse.bmat([[upper_G, None, None],
+                        [None, mid_G, None],
+                        [None, None, lower_G],
+                        [neg_test_mat, pos_test_mat, None],
+                        [None, neg_test_mat, pos_test_mat]]).tocoo()
         h = np.concatenate((upper_h, mid_h, lower_h, -EPS * np.ones(2 * (p + 1))), axis=0)
-        # convert to cvx forms
-        return cvx.matrix(c), cvx.matrix(G), cvx.matrix(h)
+        return c, G, h
     
     @staticmethod
     def _assign_solutions(upper_model, mid_model, lower_model,
@@ -181,13 +347,13 @@ class QuantModel(object):
 
         Args:
             upper_model, mid_model, lower_model - co-trained machine learning models
-            solution - solution of linear programming
+            solution - the solution vector of the program
             n, p - training data size and dimension
         
         Returns:
             None
         """
-        concat_beta = np.array(solution['x']).reshape(-1)
+        concat_beta = np.asarray(solution).reshape(-1)
         # set up boundaries
         upper_lb, upper_ub = 0, p
         mid_lb, mid_ub = n + p + 1, (n + p + 1) + p
@@ -223,10 +389,11 @@ class QuantLinear(QuantModel):
         n, p = X_train.shape
         c, G, h = QuantLinear._get_interactive_matrices(upper_model, mid_model, lower_model, 
                                                         X_train, y_train)
-        solution = cvx.solvers.lp(c, G, h, solver='glpk', 
-                                    options={'glpk': {'msg_lev': 'GLP_MSG_OFF'}})
+        # solve with HiGHS, which takes the sparse G as it is; all variables
+        # are free, unlike linprog's default of non-negative variables
+        solution = linprog(c, A_ub=G.tocsc(), b_ub=h, bounds=(None, None), method='highs')
         QuantLinear._assign_solutions(upper_model, mid_model, lower_model, 
-                                        solution, n, p)
+                                        solution.x, n, p)
     
     def predict(self, X):
         """
@@ -263,13 +430,15 @@ class QuantRidge(QuantModel):
         n, p = X_train.shape
         c, G, h = QuantRidge._get_interactive_matrices(upper_model, mid_model, lower_model,
                                                         X_train, y_train)
-        q = np.concatenate((RIDGE_ALPHA * np.ones(p), np.zeros(n + 1),
-                            RIDGE_ALPHA * np.ones(p), np.zeros(n + 1), 
-                            RIDGE_ALPHA * np.ones(p), np.zeros(n + 1)), axis=0)
-        Q = cvx.matrix(np.diag(q))
+        # convert to cvx forms, keeping G sparse
+        c, h = cvx.matrix(c), cvx.matrix(h)
+        G = cvx.spmatrix(G.data.tolist(), G.row.tolist(), G.col.tolist(), size=G.shape)
+        # the same penalty on the coefficients of each of the three models
+        q = np.tile(np.concatenate((RIDGE_ALPHA * np.ones(p), np.zeros(n + 1))), 3)
+        Q = cvx.spdiag(cvx.matrix(q))
         solution = cvx.solvers.qp(Q, c, G, h)
         QuantRidge._assign_solutions(upper_model, mid_model, lower_model, 
-                                    solution, n, p)
+                                    solution['x'], n, p)
     
     def predict(self, X):
         """
@@ -289,8 +458,9 @@ class QuantGBDT(object):
     """
     
     def __init__(self, quantile):
-        self.model = GradientBoostingRegressor(loss='quantile', alpha=quantile, 
-                    n_estimators=ESTIMATIORS, max_depth=DEPTH)
+        self.model = HistGradientBoostingRegressor(loss='quantile', quantile=quantile, 
+                    max_iter=ESTIMATIORS, max_depth=DEPTH, min_samples_leaf=1,
+                    max_leaf_nodes=None, early_stopping=False)
     
     def fit(self, X, y):
         """
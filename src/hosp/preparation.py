@@ -1,6 +1,8 @@
 """
 data preparation procedures for final value prediction task.
 """
+# standard library
+from concurrent.futures import ThreadPoolExecutor
 # first party
 import utils.epiweek as utils
 import flu_contest.src.hosp.hosp_utils as hosp_utils
@@ -10,18 +12,18 @@ from delphi_epidata.src.client.delphi_epidata import Epidata
 # third party
 import pickle
 import numpy as np
-import matplotlib.pyplot as plt
 
 from tqdm import tqdm
 
-def update_data(locations, time_period, max_lag):
+def update_data(locations, time_period, max_lag, num_threads=16):
     """ 
     Query data from flusurv API to update data for a time period.
 
     Args:
         locations - the locations we query from
-        time_period - a string representing the starting and ending epiweek
+        time_period - the starting and ending epiweek, as a tuple
         max_lag - the maximum time lag to consider for each epiweek
+        num_threads - the number of queries sent to the API concurrently
     
     Returns:
         data - the queried and processed data source
@@ -29,19 +31,25 @@ def update_data(locations, time_period, max_lag):
     data = {}
     # generate epiweeks in the time period
     period = hosp_utils.unravel(time_period)
+    # for a combination of location and epiweek, query from 0 to maximum lag
+    queries = [(epiweek, location, l) 
+                for epiweek in period 
+                for location in locations 
+                for l in range(max_lag + 1)]
+    # the queries only wait on the API, so they are sent from a pool of 
+    # threads; the results come back in the order of the queries
+    with ThreadPoolExecutor(max_workers=num_threads) as pool:
+        responses = pool.map(lambda query: Epidata.flusurv(query[1], query[0], lag=query[2]), 
+                            queries)
 
-    for epiweek in tqdm(period):
-        for location in tqdm(locations):
-            # for a combination of location and epiweek, query from 0 to maximum lag
-            for l in range(max_lag + 1):
-                current = Epidata.flusurv(location, epiweek, lag=l)
-                if 'epidata' in current:
-                    cur_data = current['epidata'][0]
-                    # if record exists, query each age group
-                    for group in range(5):
-                        if (epiweek, group, location) not in data:
-                            data[(epiweek, group, location)] = []
-                        data[(epiweek, group, location)].append(cur_data['rate_age_' + str(group)])                      
+        for (epiweek, location, l), current in tqdm(zip(queries, responses), total=len(queries)):
+            if 'epidata' in current:
+                cur_data = current['epidata'][0]
+                # if record exists, query each age group
+                for group in range(5):
+                    if (epiweek, group, location) not in data:
+                        data[(epiweek, group, location)] = []
+                    data[(epiweek, group, location)].append(cur_data['rate_age_' + str(group)])
     # fill and save the queried results
     fill_data(data, max_lag)
     write_data(data, 'data.txt')
@@ -88,6 +96,92 @@ def fetch(data, location, group, epiweek, lag, left_window, right_window, backfi
     x = x.reshape(-1, 1)
     return x, cur_y, y
 
+def fetch_batch(data, keys, lag, left_window, right_window, backfill_window):
+    """
+    the same as fetch, for many (epiweek, group, location) keys at once.
+
+    the series within the windows are stacked into one array, and the 
+    predictors of all keys are gathered from it with a single index.
+
+    Args:
+        data - the data source (included all epiweeks with all lags)
+        keys - a list of (epiweek, group, location) keys in the data source
+        lag - the current time lag
+        left_window, right_window - represent the interval 
+            [epiweek - left_window, epiweek + right_window]
+        backfill_window - the "width" of backfill
+    
+    Returns:
+        X - the predictors, one row per key
+        cur_Y - the values at the current time lag
+        Y - the final values
+    """
+    width = left_window + right_window + 1
+    windows = {}
+    # rows[k, pos] is the stacked series of the pos-th epiweek in the window
+    # of the k-th key, or -1 if there is no data
+    rows = np.empty((len(keys), width), dtype=int)
+    row_index = {}
+    records = []
+
+    for k, (epiweek, group, location) in enumerate(keys):
+        if (epiweek, group, location) not in data:
+            raise KeyError((epiweek, group, location))
+        if epiweek not in windows:
+            windows[epiweek] = hosp_utils.get_window(epiweek, left_window, right_window)
+
+        for pos, window_epiweek in enumerate(windows[epiweek]):
+            key = (window_epiweek, group, location)
+            if key not in row_index:
+                if key in data:
+                    row_index[key] = len(records)
+                    records.append(data[key])
+                else:
+                    row_index[key] = -1
+            rows[k, pos] = row_index[key]
+    # stack the series, the last row (i.e. -1) is left empty for no data
+    lengths = np.array([len(record) for record in records] + [0])
+    series = np.zeros((len(lengths), max(1, lengths.max())))
+    for row, record in enumerate(records):
+        series[row, :len(record)] = record
+    # x[pos, col] takes record[lag - pos + left_window - backfill_window + col],
+    # and stays 0 before the first record (or with no data)
+    cols = lag + left_window - backfill_window - np.arange(width)[:, np.newaxis] + \
+            np.arange(backfill_window + 1)
+    present = (rows >= 0)[:, :, np.newaxis] & (cols >= 0)
+    if np.any(present & (cols >= lengths[rows][:, :, np.newaxis])):
+        raise Exception('series are too short for the windows')
+    X = np.where(present, 
+                series[rows[:, :, np.newaxis], np.clip(cols, 0, series.shape[1] - 1)], 0)
+    # the series of the keys themselves are at the center of the windows
+    key_rows = rows[:, left_window]
+    cur_Y = series[key_rows, lag]
+    Y = series[key_rows, lengths[key_rows] - 1]
+    return X.reshape(len(keys), width * (backfill_window + 1)), cur_Y, Y
+
+def slice_window(X, max_left_window, max_backfill_window, 
+                left_window, right_window, backfill_window):
+    """
+    cut predictors collected with a larger window down to a smaller one.
+
+    the predictors for [epiweek - left_window, epiweek + right_window] with
+    a given backfill_window are the trailing rows and columns of the ones
+    for a larger left_window and backfill_window, so they can be sliced
+    instead of being fetched again.
+
+    Args:
+        X - the predictors (one sample per row) from fetch or prepare, with
+            max_left_window, right_window and max_backfill_window
+        max_left_window, max_backfill_window - the windows X was collected with
+        left_window, right_window, backfill_window - the windows to cut X to
+    
+    Returns:
+        the predictors for the smaller windows
+    """
+    X = X.reshape(len(X), max_left_window + right_window + 1, max_backfill_window + 1)
+    X = X[:, max_left_window - left_window:, max_backfill_window - backfill_window:]
+    return X.reshape(len(X), -1)
+
 def prepare(data, locations, groups, periods, lag, left_window, right_window, backfill_window):
     """
     collect data from different locations, groups, and time periods.
@@ -102,26 +196,17 @@ def prepare(data, locations, groups, periods, lag, left_window, right_window, ba
             [epiweek - left_window, epiweek + right_window]
         backfill_window - the "width" of backfill
     """
-    # collector
-    total_X = []
-    total_Y = []
-
-    for time_period in periods:
-        period = hosp_utils.unravel(time_period)
-
-        for epiweek in period:
-            for location in locations:
-                for group in groups:
-                    # fetch the data for each epiweek, location and group within the period
-                    if (epiweek, group, location) in data:
-                        x, _, y = fetch(data, 
-                                        location, group, epiweek, 
-                                        lag, left_window, right_window, backfill_window)
-                        # if data exists, collect
-                        if np.any(y):
-                            total_X.append(x)
-                            total_Y.append(y)
-    # vectorize data
-    total_X = np.vstack(total_X).reshape(len(total_X), -1)  
-    total_Y = np.array(total_Y).squeeze()
+    # all epiweeks, locations and groups with data within the periods, 
+    # where only the samples with a final value are collected; the samples
+    # are filtered before fetching, so that the arrays are built once at 
+    # their final size
+    keys = [(epiweek, group, location) 
+            for time_period in periods 
+            for epiweek in hosp_utils.unravel(time_period)
+            for location in locations 
+            for group in groups 
+            if (epiweek, group, location) in data 
+                and any(data[(epiweek, group, location)][-1:])]
+    total_X, _, total_Y = fetch_batch(data, keys, 
+                                    lag, left_window, right_window, backfill_window)
     return total_X, total_Y
@@ -18,10 +18,13 @@ from flu_contest.src.hosp.constants import *
 import os
 import pickle
 import numpy as np
+import matplotlib
+# reports are only written to files, so skip the interactive backend
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 
 from tqdm import tqdm
-from sklearn import metrics
+from joblib import Parallel, delayed
 
 def train_model(X, Y, model_type):
     """
@@ -35,6 +38,10 @@ def train_model(X, Y, model_type):
     Returns:
         model - the trained machine learning model
     """
+    # hand every model C-contiguous doubles, so that neither sklearn nor 
+    # cvxopt has to copy or convert the inputs internally
+    X = np.ascontiguousarray(X, dtype=float)
+    Y = np.ascontiguousarray(Y, dtype=float)
     # determine if co-training is necessary
     cotrain = (model_type == 'quant_lin' or model_type == 'quant_ridge')
 
@@ -67,26 +74,30 @@ def train_model(X, Y, model_type):
             model = ml_utils.QuantGBDT(MID_QUANT)
             model_lower = ml_utils.QuantGBDT(LOWER_QUANT)
         
-        model_upper.fit(X, Y)
-        model.fit(X, Y)
-        model_lower.fit(X, Y)
+        if isinstance(model, ml_utils.RegModel):
+            # the bounds share one regression and bootstrap
+            ml_utils.RegModel.fit_interval(model_upper, model, model_lower, X, Y)
+        else:
+            model_upper.fit(X, Y)
+            model.fit(X, Y)
+            model_lower.fit(X, Y)
 
     return model_upper, model, model_lower
 
-def validate(data, 
-            locations, groups, 
-            time_period, lag, 
-            left_window, right_window, backfill_window,
-            mode, model_type):
+def prepare_validation(data, 
+                        locations, groups, 
+                        time_period, lag, 
+                        left_window, right_window, backfill_window,
+                        mode):
     """
-    apply cross-validation for a time period with other seasons
-    as training data.
+    collect the training and validation data for cross-validation
+    of a time period with other seasons as training data.
 
     Args:
         data - the data source
         locations - the list of locations for machine learning model
         groups - the list of groups for machine learning model
-        time_period - a string representing the starting and ending epiweek
+        time_period - the starting and ending epiweek, as a tuple
         lag - the current time lag
         left_window, right_window - the time period considered for regression: 
             [cur_time - left_window, cur_time + right_window]
@@ -94,68 +105,124 @@ def validate(data,
         mode - the training scheme.
             prev: use the seasons within year window as training data
             all: use all previous seasons as training data
-        model_type - the name of machine learning model
     
     Returns:
+        X, Y - the training data
+        X_val - the validation inputs, one sample per row
+        cells - the (location, group, week) indices of the validation samples
         valid_weeks - the active epiweeks for flu
-        predictions, prediction_upper, prediction_lower - 
-            the predicted final values, the latter two form confidence intervals
         cur_truth - the final value of series at current time
         ground_truth - the final values provided by CDC after backfill
+
+        the last two are arrays indexed by location, group, and week,
+        with nan for the weeks where a location and group has no data.
     """
     start_year = hosp_utils.get_start_year(time_period[0])
     period = hosp_utils.unravel(time_period)
-    model_periods = []
+    years = []
 
     # obtain all training seasons
     if mode == 'all':
-        for year in range(FIRST_YEAR, start_year):
-            model_periods.append(hosp_utils.get_period(year, 40, 17))
+        years = range(FIRST_YEAR, start_year)
     elif mode == 'prev':
-        for year in range(max(FIRST_YEAR, start_year - YEAR_WINDOW), start_year):
-            model_periods.append(hosp_utils.get_period(year, 40, 17))
-    # train models
+        years = range(max(FIRST_YEAR, start_year - YEAR_WINDOW), start_year)
+    starts, ends = hosp_utils.get_period_batch(np.array(years, dtype=int), 40, 17)
+    model_periods = list(zip(starts.tolist(), ends.tolist()))
+    # training data
     X, Y = preparation.prepare(data, locations, groups, 
                                 model_periods, lag, 
                                 left_window, right_window, backfill_window)
+    # result collectors, indexed by location, group and week
+    shape = (len(locations), len(groups), len(period))
+    ground_truth = np.full(shape, np.nan)
+    cur_truth = np.full(shape, np.nan)
+    valid_weeks = list(period)
+    # the (location, group, week) cell of each validation sample, i.e. 
+    # wherever data exists
+    cells = [(l_idx, g_idx, w_idx) 
+            for w_idx, epiweek in enumerate(period) 
+            for l_idx, location in enumerate(locations) 
+            for g_idx, group in enumerate(groups) 
+            if (epiweek, group, location) in data]
+    keys = [(period[w_idx], groups[g_idx], locations[l_idx]) 
+            for l_idx, g_idx, w_idx in cells]
+    X_val, cur_y_val, y_val = preparation.fetch_batch(data, keys, 
+                                                    lag, left_window, right_window, 
+                                                    backfill_window)
+    cells = tuple(np.array(cells, dtype=int).reshape(-1, 3).T)
+    # record ground truth
+    cur_truth[cells] = cur_y_val
+    ground_truth[cells] = y_val
+    return X, Y, X_val, cells, valid_weeks, cur_truth, ground_truth
+
+def validate_prepared(X, Y, X_val, cells, valid_weeks, cur_truth, ground_truth, model_type):
+    """
+    train models and predict the validation samples collected by 
+    prepare_validation.
+
+    Args:
+        X, Y, X_val, cells, valid_weeks, cur_truth, ground_truth - 
+            as returned by prepare_validation
+        model_type - the name of machine learning model
+    
+    Returns:
+        the same as validate
+    """
     model_upper, model, model_lower = train_model(X, Y, model_type)
-    # result collectors
-    predictions = create_double_list([], len(locations), len(groups))
-    predictions_lower = create_double_list([], len(locations), len(groups))
-    predictions_upper = create_double_list([], len(locations), len(groups))
-    ground_truth = create_double_list([], len(locations), len(groups))
-    cur_truth = create_double_list([], len(locations), len(groups))
-    valid_weeks = []
-
-    for epiweek in period:
-        valid_weeks.append(epiweek)
-
-        for l_idx in range(len(locations)):
-            location = locations[l_idx]
-
-            for g_idx in range(len(groups)):
-                group = groups[g_idx]
-
-                # if data exists, perform cross-validation
-                if (epiweek, group, location) in data:
-                    x_val, cur_y_val, y_val = preparation.fetch(data, location, group, 
-                                                                epiweek, lag, 
-                                                                left_window, right_window, 
-                                                                backfill_window)
-                    pred = model.predict(x_val.T)
-                    pred_u = model_upper.predict(x_val.T)
-                    pred_l = model_lower.predict(x_val.T)
-                    # record results
-                    predictions[l_idx][g_idx].append(pred)
-                    predictions_lower[l_idx][g_idx].append(pred_l)
-                    predictions_upper[l_idx][g_idx].append(pred_u)
-                    # record ground truth
-                    cur_truth[l_idx][g_idx].append(cur_y_val)
-                    ground_truth[l_idx][g_idx].append(y_val)
+    # result collectors, indexed by location, group and week
+    predictions = np.full(cur_truth.shape, np.nan)
+    predictions_lower = np.full(cur_truth.shape, np.nan)
+    predictions_upper = np.full(cur_truth.shape, np.nan)
+
+    if len(X_val):
+        # predict all samples at once, rather than one model call per sample
+        predictions[cells] = model.predict(X_val)
+        predictions_lower[cells] = model_lower.predict(X_val)
+        predictions_upper[cells] = model_upper.predict(X_val)
     
     return valid_weeks, predictions, predictions_lower, predictions_upper, \
         cur_truth, ground_truth
 
+def validate(data, 
+            locations, groups, 
+            time_period, lag, 
+            left_window, right_window, backfill_window,
+            mode, model_type):
+    """
+    apply cross-validation for a time period with other seasons
+    as training data.
+
+    Args:
+        data - the data source
+        locations - the list of locations for machine learning model
+        groups - the list of groups for machine learning model
+        time_period - the starting and ending epiweek, as a tuple
+        lag - the current time lag
+        left_window, right_window - the time period considered for regression: 
+            [cur_time - left_window, cur_time + right_window]
+        backfill_window - the backfill period: [cur_time-window, cur_time]
+        mode - the training scheme.
+            prev: use the seasons within year window as training data
+            all: use all previous seasons as training data
+        model_type - the name of machine learning model
+    
+    Returns:
+        valid_weeks - the active epiweeks for flu
+        predictions, prediction_upper, prediction_lower - 
+            the predicted final values, the latter two form confidence intervals
+        cur_truth - the final value of series at current time
+        ground_truth - the final values provided by CDC after backfill
+
+        the last five are arrays indexed by location, group, and week,
+        with nan for the weeks where a location and group has no data.
+    """
+    prepared = prepare_validation(data, 
+                                locations, groups, 
+                                time_period, lag, 
+                                left_window, right_window, backfill_window, 
+                                mode)
+    return validate_prepared(*prepared, model_type)
+
 def nowcast_report(path, data, 
                     locations, groups, 
                     time_period, 
@@ -169,7 +236,7 @@ def nowcast_report(path, data,
         data - the data source
         locations - the locations to report
         groups - the groups to report
-        time_period - a string representing the starting and ending epiweek
+        time_period - the starting and ending epiweek, as a tuple
         left_window - the time period considered for linear regression: 
             [cur_time-left_window, cur_time]
         backfill_window - the time period considered for backfill: 
@@ -183,50 +250,76 @@ def nowcast_report(path, data,
         rsq - the explained variance statistics of prediction
         mse - the mean squared error of prediction
     """
-    # result collectors
-    rsq = create_double_list(None, len(locations), len(groups))
-    mse = create_double_list(None, len(locations), len(groups))
+    prepared = prepare_validation(data, 
+                                locations, groups,
+                                time_period, lag=0, 
+                                left_window=left_window, right_window=0, 
+                                backfill_window=backfill_window, 
+                                mode=mode)
+    return nowcast_report_prepared(path, locations, groups, 
+                                    left_window, backfill_window, 
+                                    prepared, model_type)
+
+def nowcast_report_prepared(path, 
+                            locations, groups, 
+                            left_window, backfill_window, 
+                            prepared, model_type):
+    """
+    the same as nowcast_report, for cross-validation data already 
+    collected by prepare_validation.
+
+    Args:
+        path, locations, groups, left_window, backfill_window, model_type - 
+            as in nowcast_report
+        prepared - the results of prepare_validation for the windows
+    
+    Returns:
+        the same as nowcast_report
+    """
+    # result collectors, indexed by location and group
+    rsq = np.full((len(locations), len(groups)), np.nan)
+    mse = np.full((len(locations), len(groups)), np.nan)
     # run cross validation and calculate statistics
     valid_weeks, \
     predictions, predictions_lower, predictions_upper, \
-    cur_truth, ground_truth = \
-    validate(data, 
-            locations, groups,
-            time_period, lag=0, 
-            left_window=left_window, right_window=0, 
-            backfill_window=backfill_window, 
-            mode=mode, model_type=model_type)
+    cur_truth, ground_truth = validate_prepared(*prepared, model_type)
+    # plot with epiweeks as ticks for x-axis
+    inds = range(len(valid_weeks))
+    week_ticks = [str(epiweek % 100) for epiweek in valid_weeks]
+    # a single figure is cleared and reused for every location and group
+    fig, ax = plt.subplots()
 
     for l_idx in range(len(locations)):
         location = locations[l_idx]
 
         for g_idx in range(len(groups)): 
             group = groups[g_idx]
-            rsq[l_idx][g_idx] = metrics.r2_score(
-                                ground_truth[l_idx][g_idx], predictions[l_idx][g_idx])
-            mse[l_idx][g_idx] = metrics.mean_squared_error(
-                                ground_truth[l_idx][g_idx], predictions[l_idx][g_idx])
-            # plot with epiweeks as ticks for x-axis
-            inds = range(len(valid_weeks))
-            week_ticks = [str(epiweek % 100) for epiweek in valid_weeks]
+            # only score the weeks with data
+            mask = ~np.isnan(ground_truth[l_idx, g_idx])
+            rsq[l_idx, g_idx] = ml_utils.r2_score(
+                                ground_truth[l_idx, g_idx, mask], predictions[l_idx, g_idx, mask])
+            mse[l_idx, g_idx] = ml_utils.mean_squared_error(
+                                ground_truth[l_idx, g_idx, mask], predictions[l_idx, g_idx, mask])
             # plot predicted rate, true rate, and current rate
-            plt.figure()
-            plt.plot(inds, predictions[l_idx][g_idx], label='predicted rate')
-            plt.plot(inds, predictions_upper[l_idx][g_idx], label='predicted rate upper bound')
-            plt.plot(inds, predictions_lower[l_idx][g_idx], label='predicted rate lower bound')
-            plt.plot(inds, cur_truth[l_idx][g_idx], label='current rate')
-            plt.plot(inds, ground_truth[l_idx][g_idx], label='true rate')
-            plt.xticks(inds, week_ticks, rotation='vertical')
-            plt.xlabel('weeks')
-            plt.ylabel('hospitalized rate')
-            plt.legend()
-            plt.savefig(path + '/' + location + '/' + str(group) + '-' +
-                        str(left_window) + '-' + str(backfill_window) + '.png', dpi=300)
-            plt.close()
-        
+            ax.clear()
+            ax.plot(inds, predictions[l_idx, g_idx], label='predicted rate')
+            ax.plot(inds, predictions_upper[l_idx, g_idx], label='predicted rate upper bound')
+            ax.plot(inds, predictions_lower[l_idx, g_idx], label='predicted rate lower bound')
+            ax.plot(inds, cur_truth[l_idx, g_idx], label='current rate')
+            ax.plot(inds, ground_truth[l_idx, g_idx], label='true rate')
+            ax.set_xticks(inds)
+            ax.set_xticklabels(week_ticks, rotation='vertical')
+            ax.set_xlabel('weeks')
+            ax.set_ylabel('hospitalized rate')
+            ax.legend()
+            # one plot per (window, backfill) of the sweep, at a lower resolution
+            fig.savefig(path + '/' + location + '/' + str(group) + '-' +
+                        str(left_window) + '-' + str(backfill_window) + '.png', dpi=SWEEP_DPI)
+    
+    plt.close(fig)
     return rsq, mse
 
-def plot_results(path, results, name, location, group, colormap):
+def plot_results(path, results, name, location, group, colormap, ax=None):
     """
     plot the mse / rsq results as heatmap for each location and group.
 
@@ -237,12 +330,19 @@ def plot_results(path, results, name, location, group, colormap):
         locations - the location to report
         groups - the group to report
         colormap - the colormap used for heatmap
+        ax - the axes to draw on, which are cleared and reused; a new
+            figure is created (and closed) if not given
     
     Returns:
         None
     """
     length, width = results.shape
-    fig, ax = plt.subplots()
+    new_figure = ax is None
+    if new_figure:
+        fig, ax = plt.subplots()
+    else:
+        fig = ax.figure
+        ax.clear()
     ax.imshow(results, cmap=colormap)
 
     ax.set_title(GROUP_DESCRIPTIONS[group])
@@ -257,14 +357,15 @@ def plot_results(path, results, name, location, group, colormap):
             ax.text(j, i, '{:.2f}'.format(results[i][j]), ha='center', va='center', color='w')
     
     fig.tight_layout()
-    plt.savefig(path + '/' + location + '/' + name + '_results_' + str(group) + '.png', dpi=300)
-    plt.close(fig)
+    fig.savefig(path + '/' + location + '/' + name + '_results_' + str(group) + '.png', dpi=300)
+    if new_figure:
+        plt.close(fig)
 
 def run_nowcast_experiment(data, 
                             location_groups, groupings, 
                             time_periods, 
                             max_window, 
-                            mode, model_type):
+                            mode, model_type, n_jobs=-1):
     """
     run nowcast experiments for different time periods.
 
@@ -272,20 +373,27 @@ def run_nowcast_experiment(data,
         data - the data source (included all epiweeks with all lags)
         location_groups - the groupings for states
         groupings - the groupings for age groups
-        time_periods - a list of time period (strings representing the starting and ending epiweek)
+        time_periods - a list of time periods (tuples of the starting and ending epiweek)
         max_window - the maximum time window considered in experiment
         mode - the training scheme.
             prev: use the seasons within year window as training data
             all: use all previous seasons as training data
         model_type - the machine learning model used
+        n_jobs - the number of processes running the (window, backfill)
+            experiments in parallel, -1 for all cores
     
     Returns:
         None
     """
+    # all (window, backfill) experiments, which are independent of each other
+    cells = [(window, backfill) 
+                for window in range(max_window + 1) for backfill in range(window + 1)]
     # matrix for recording results, will be copied for each entry
     results = {}
     mse_record_mat = np.full((max_window + 1, max_window + 1), -np.inf)
     rsq_record_mat = np.full((max_window + 1, max_window + 1), -np.inf)
+    # a single figure is cleared and reused for every heatmap
+    fig, ax = plt.subplots()
 
     for period in time_periods:
         # create path for writing reports
@@ -302,19 +410,29 @@ def run_nowcast_experiment(data,
             for groups in groupings:
                 mse_results = create_double_list(mse_record_mat, len(locations), len(groups))
                 rsq_results = create_double_list(rsq_record_mat, len(locations), len(groups))
-                # record the result for each time window and backfill
-                for window in tqdm(range(max_window + 1)):
-                    for backfill in range(window + 1):
-                        rsq, mse = nowcast_report(report_path, data, 
+                # collect the cross-validation data once for the largest windows,
+                # the data for every experiment are slices of it
+                X_max, Y, X_val_max, *others = prepare_validation(data, 
                                                 locations, groups, 
-                                                period, 
-                                                left_window=window, backfill_window=backfill, 
-                                                mode=mode, model_type=model_type)
-
-                        for l_idx in range(len(locations)):
-                            for g_idx in range(len(groups)):
-                                mse_results[l_idx][g_idx][window][backfill] = mse[l_idx][g_idx]
-                                rsq_results[l_idx][g_idx][window][backfill] = rsq[l_idx][g_idx]
+                                                period, lag=0, 
+                                                left_window=max_window, right_window=0, 
+                                                backfill_window=max_window, mode=mode)
+                # record the result for each time window and backfill
+                reports = Parallel(n_jobs=n_jobs)(
+                            delayed(nowcast_report_prepared)(report_path, 
+                                locations, groups, 
+                                window, backfill, 
+                                (preparation.slice_window(X_max, max_window, max_window, 
+                                                            window, 0, backfill), 
+                                Y, 
+                                preparation.slice_window(X_val_max, max_window, max_window, 
+                                                            window, 0, backfill)) + tuple(others), 
+                                model_type)
+                            for window, backfill in tqdm(cells))
+
+                for (window, backfill), (rsq, mse) in zip(cells, reports):
+                    mse_results[:, :, window, backfill] = mse
+                    rsq_results[:, :, window, backfill] = rsq
                 # plot the results
                 for l_idx in range(len(locations)):
                     location = locations[l_idx]
@@ -323,18 +441,19 @@ def run_nowcast_experiment(data,
                         group = groups[g_idx]
 
                         plot_results(report_path, mse_results[l_idx][g_idx], 
-                                    'mse', location, group, 'Reds')
+                                    'mse', location, group, 'Reds', ax)
                         plot_results(report_path, rsq_results[l_idx][g_idx], 
-                                    'rsq', location, group, 'Blues')
+                                    'rsq', location, group, 'Blues', ax)
                         # set the maximum as model metric
                         results[(period, group)] = np.amax(rsq_results[l_idx][g_idx])
 
+    plt.close(fig)
     write_data(results, './nowcast/results.txt')
 
 def predict(data, epiweek, 
             location_groups, groupings, 
             max_window, 
-            mode, model_type):
+            mode, model_type, n_jobs=-1):
     """
     #TODO: support location / age group combination
 
@@ -354,6 +473,8 @@ def predict(data, epiweek,
             prev: use the seasons within year window as training data
             all: use all previous seasons as training data
         model_type - the type of machine learning model used
+        n_jobs - the number of processes cross-validating the windows
+            in parallel, -1 for all cores
     
     Returns:
         preds, preds_upper, preds_lower - the prediction results
@@ -370,26 +491,37 @@ def predict(data, epiweek,
         for gp_idx in range(len(groupings)):
             groups = groupings[gp_idx]
 
-            cur_preds = create_double_list([], len(locations), len(groups))
-            cur_preds_upper = create_double_list([], len(locations), len(groups))
-            cur_preds_lower = create_double_list([], len(locations), len(groups))
-
             opt_window = 0
             cur_rsq = 0.0
 
-            # perform cross-validation and select the optimal hyperparameters, 
-            # i.e. window and backfill
-            for window in range(0, max_window + 1):
-                _, predictions, _, _, _, ground_truth = validate(data, 
-                                                        locations, groups, 
-                                                        val_period, lag=0, 
-                                                        left_window=window, right_window=0, 
-                                                        backfill_window=window,
-                                                        model_type=model_type, mode=mode)
-                # calculate metrics and compare
-                predictions = np.vstack(flatten_double_list(predictions)).squeeze()
-                ground_truth = np.vstack(flatten_double_list(ground_truth)).squeeze()
-                rsq = metrics.r2_score(ground_truth, predictions) - PENALTY * window
+            # collect the cross-validation data once for the largest window,
+            # the data for smaller windows are slices of it
+            X_max, Y, X_val_max, cells, valid_weeks, cur_truth, ground_truth = \
+                prepare_validation(data, 
+                                locations, groups, 
+                                val_period, lag=0, 
+                                left_window=max_window, right_window=0, 
+                                backfill_window=max_window, mode=mode)
+
+            # perform cross-validation for all windows, which are independent
+            # of each other
+            windows = range(0, max_window + 1)
+            validations = Parallel(n_jobs=n_jobs)(
+                            delayed(validate_prepared)(
+                                preparation.slice_window(X_max, max_window, max_window, 
+                                                        window, 0, window), 
+                                Y, 
+                                preparation.slice_window(X_val_max, max_window, max_window, 
+                                                        window, 0, window), 
+                                cells, valid_weeks, cur_truth, ground_truth, 
+                                model_type)
+                            for window in windows)
+            # select the optimal hyperparameters, i.e. window and backfill
+            mask = ~np.isnan(ground_truth)
+
+            for window, (_, predictions, _, _, _, _) in zip(windows, validations):
+                # calculate metrics over the weeks with data and compare
+                rsq = ml_utils.r2_score(ground_truth[mask], predictions[mask]) - PENALTY * window
 
                 if rsq > cur_rsq:
                     opt_window = window
@@ -405,33 +537,17 @@ def predict(data, epiweek,
             # get trained model and residuals
             model_upper, model, model_lower = train_model(X, Y, model_type)
 
-            for l_idx in range(len(locations)):
-                location = locations[l_idx]
-
-                for g_idx in range(len(groups)):
-                    group = groups[g_idx]
-                    X_pred, _, _ = preparation.fetch(data, 
-                                                    location, group, 
-                                                    epiweek, lag=0, 
-                                                    left_window=opt_window, right_window=0, 
-                                                    backfill_window=opt_window)
-                    # get results from prediction 
-                    pred_u = model_upper.predict(X_pred.T)
-                    pred = model.predict(X_pred.T)
-                    pred_l = model_lower.predict(X_pred.T)
-                    # add to records
-                    cur_preds[l_idx][g_idx].append(pred)
-                    cur_preds_upper[l_idx][g_idx].append(pred_u)
-                    cur_preds_lower[l_idx][g_idx].append(pred_l)
-            
-            for l_idx in range(len(locations)):
-                location = locations[l_idx]
-
-                for g_idx in range(len(groups)):
-                    group = groups[g_idx]
-                    # assign predictions to locations and groups
-                    preds[(location, group)] = cur_preds[l_idx][g_idx][0][0]
-                    preds_upper[(location, group)] = cur_preds_upper[l_idx][g_idx][0][0]
-                    preds_lower[(location, group)] = cur_preds_lower[l_idx][g_idx][0][0]
+            # one input row for each location and group
+            keys = [(location, group) for location in locations for group in groups]
+            X_pred, _, _ = preparation.fetch_batch(data, 
+                                                [(epiweek, group, location) 
+                                                    for location, group in keys], 
+                                                lag=0, 
+                                                left_window=opt_window, right_window=0, 
+                                                backfill_window=opt_window)
+            # get results from prediction, and assign them to locations and groups
+            preds.update(zip(keys, model.predict(X_pred)))
+            preds_upper.update(zip(keys, model_upper.predict(X_pred)))
+            preds_lower.update(zip(keys, model_lower.predict(X_pred)))
 
     return preds, preds_upper, preds_lower
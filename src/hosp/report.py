@@ -49,7 +49,7 @@ def plot_empty_rate(data, time_periods):
 
         for group in range(5):
             plt.plot(inds, empty_rates[(location, group)], 
-                                label=hosp_utils.GROUP_DESCRIPTION[group])
+                                label=hosp_utils.GROUP_DESCRIPTIONS[group])
         
         plt.legend()
         plt.savefig(location + '.png', dpi=300)
@@ -92,7 +92,7 @@ def plot_backfill_rate(data, time_periods):
 
         for group in range(5):
             plt.plot(inds, backfill_rates[(location, group)], 
-                                label=hosp_utils.GROUP_DESCRIPTION[group])
+                                label=hosp_utils.GROUP_DESCRIPTIONS[group])
         
         plt.legend()
         plt.savefig(location + '.png', dpi=300)
@@ -122,7 +122,7 @@ def plot_backfill(data, time_period):
 
     for group in range(5):
         title = 'Season: ' + str(start_yr) + '-' + str(end_yr) + ', ' + \
-                hosp_utils.GROUP_DESCRIPTION[group]
+                hosp_utils.GROUP_DESCRIPTIONS[group]
         backfill = np.array(ground_truth[group]).squeeze() - np.array(cur_truth[group]).squeeze()
         ymax = np.max(np.array(ground_truth[group])) + 0.5
 
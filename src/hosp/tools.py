@@ -1,10 +1,13 @@
 # third party
 from copy import deepcopy
+import numpy as np
 
 def create_double_list(obj, dim_x, dim_y):
     """
     create a 2-dimensional list copies for an object.
     all objects in the list are deep copies of the object.
+    numpy arrays are copied into a single array of shape
+    (dim_x, dim_y) + obj.shape instead, which indexes the same way.
 
     Args:
         obj - the original object
@@ -14,7 +17,9 @@ def create_double_list(obj, dim_x, dim_y):
     Returns:
         the 2-dimensional list copies of the object
     """
-    return [list(deepcopy(obj) for _ in range(dim_y)) for _ in range(dim_x)]
+    if isinstance(obj, np.ndarray):
+        return np.broadcast_to(obj, (dim_x, dim_y) + obj.shape).copy()
+    return [[deepcopy(obj) for _ in range(dim_y)] for _ in range(dim_x)]
 
 def flatten_double_list(double_list):
     """
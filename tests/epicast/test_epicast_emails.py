@@ -98,3 +98,14 @@ class Tests(unittest.TestCase):
     self.assertIn('a friendly reminder', html.lower())
 
     self.make_common_assertions(subject, text, html)
+
+  def test_prepare_templates_is_cached(self):
+    """Prepare each pair of templates only once."""
+
+    template = EpicastEmails.Template.REMINDER
+    first = EpicastEmails.prepare_templates(template['text'], template['html'])
+    second = EpicastEmails.prepare_templates(template['text'], template['html'])
+
+    self.assertIs(first, second)
+    self.assertIn('unsubscribe', first[0].lower())
+    self.assertIn('unsubscribe', first[1].lower())
@@ -45,6 +45,7 @@ class Tests(unittest.TestCase):
         test=False,
         print=False,
         force=True,
+        concurrency=1,
         type='notifications')
     mock_connector = MagicMock()
     cnx = connect_to_database(mock_connector)
@@ -52,7 +53,7 @@ class Tests(unittest.TestCase):
     mock_emailer = MagicMock()
 
     # this is not elegant, but it's a quick way to simulate each query
-    def handle_query(sql):
+    def handle_query(sql, args=()):
 
       # get_users
       if sql.startswith('SELECT u.`hash`'):
@@ -60,11 +61,11 @@ class Tests(unittest.TestCase):
 
       # get_scores
       if sql.startswith('SELECT coalesce'):
-        cur.__iter__.return_value = [(1, 2, 3, 4)]
+        cur.fetchone.return_value = (1, 2, 3, 4)
 
       # get_deadline_day_name
       if sql.startswith('SELECT dayname'):
-        cur.__iter__.return_value = [('Someday',)]
+        cur.fetchone.return_value = ('Someday',)
 
     cur.execute = handle_query
 
@@ -85,6 +86,7 @@ class Tests(unittest.TestCase):
         test=False,
         print=False,
         force=True,
+        concurrency=1,
         type='reminders')
     mock_connector = MagicMock()
     cnx = connect_to_database(mock_connector)
@@ -92,7 +94,7 @@ class Tests(unittest.TestCase):
     mock_emailer = MagicMock()
 
     # this is not elegant, but it's a quick way to simulate each query
-    def handle_query(sql):
+    def handle_query(sql, args=()):
 
       # get_users
       if sql.startswith('SELECT u.`hash`'):
@@ -100,11 +102,11 @@ class Tests(unittest.TestCase):
 
       # get_scores
       if sql.startswith('SELECT coalesce'):
-        cur.__iter__.return_value = [(1, 2, 3, 4)]
+        cur.fetchone.return_value = (1, 2, 3, 4)
 
       # get_deadline_day_name
       if sql.startswith('SELECT dayname'):
-        cur.__iter__.return_value = [('Someday',)]
+        cur.fetchone.return_value = ('Someday',)
 
     cur.execute = handle_query
 
@@ -116,3 +118,78 @@ class Tests(unittest.TestCase):
 
     # check for final database close as proxy for successful run
     self.assertTrue(cnx.close.called)
+
+  def run_main_alerts(self, users, concurrency, mock_emailer):
+    """Run `main` for alerts with the given users and emailer."""
+
+    args = MagicMock(
+        verbose=False,
+        test=False,
+        print=False,
+        force=False,
+        concurrency=concurrency,
+        type='alerts')
+    mock_connector = MagicMock()
+    cnx = connect_to_database(mock_connector)
+    cur = cnx.cursor()
+
+    def handle_query(sql, values=()):
+
+      # get_users, where nobody has the `_debug` preference
+      if sql.startswith('SELECT u.`hash`'):
+        if values[0] == 'email_notifications':
+          cur.__iter__.return_value = users
+        else:
+          cur.__iter__.return_value = []
+
+      # get_deadline_day_name
+      if sql.startswith('SELECT dayname'):
+        cur.fetchone.return_value = ('Someday',)
+
+    cur.execute = handle_query
+
+    main(args, connector_impl=mock_connector, emailer_impl=mock_emailer)
+    return cnx
+
+  def test_main_concurrency(self):
+    """Queue emails for several users in parallel."""
+
+    users = [
+      ('%08d%s' % (i, 'f' * 24), 'User %d' % i, 'user%d@example.com' % i)
+      for i in range(10)
+    ]
+    mock_emailer = MagicMock()
+
+    cnx = self.run_main_alerts(users, 4, mock_emailer)
+
+    self.assertEqual(mock_emailer.queue_email.call_count, len(users))
+    self.assertEqual(
+        {call[1]['to'] for call in mock_emailer.queue_email.call_args_list},
+        {user[2] for user in users})
+    self.assertEqual(mock_emailer.call_emailer.call_count, 1)
+    self.assertTrue(cnx.close.called)
+
+  def test_main_queue_failure(self):
+    """Don't send anything when an email can't be queued."""
+
+    users = [
+      ('%08d%s' % (i, 'f' * 24), 'User %d' % i, 'user%d@example.com' % i)
+      for i in range(5)
+    ]
+    mock_emailer = MagicMock()
+    mock_emailer.queue_email.side_effect = Exception('queue failed')
+
+    with self.assertRaises(Exception):
+      self.run_main_alerts(users, 3, mock_emailer)
+
+    self.assertFalse(mock_emailer.call_emailer.called)
+
+  def test_main_no_recipients(self):
+    """Flush the email queue even without any recipients."""
+
+    mock_emailer = MagicMock()
+
+    self.run_main_alerts([], 2, mock_emailer)
+
+    self.assertFalse(mock_emailer.queue_email.called)
+    self.assertTrue(mock_emailer.call_emailer.called)
@@ -0,0 +1,34 @@
+"""Unit tests for fluv_ranks.py."""
+
+# standard library
+import unittest
+
+# third party
+import numpy as np
+import scipy.stats
+
+# py3tester coverage target
+__test_target__ = 'delphi.flu_contest.epicast.fluv_ranks'
+
+
+class Tests(unittest.TestCase):
+  """Basic unit tests."""
+
+  def test_rank_min(self):
+    """Ranks are the same as scipy's, including ties."""
+    rng = np.random.RandomState(0)
+    for values in (
+      rng.randint(0, 4, (3, 5, 5, 7)).astype(float),
+      rng.rand(4, 6, 9),
+      np.zeros((2, 3, 5)),
+      rng.randint(0, 2, (50, 2)),
+      rng.rand(3, 1),
+    ):
+      with self.subTest(shape=values.shape):
+        expected = scipy.stats.rankdata(values, method='min', axis=-1)
+        self.assertTrue(np.array_equal(rank_min(values), expected))
+
+  def test_rank_min_ties(self):
+    """Ties share the smallest of their ranks."""
+    self.assertEqual(
+        rank_min([0.5, 0, 0.5, 0, 2, 0.5]).tolist(), [3, 1, 3, 1, 6, 3])
@@ -0,0 +1,68 @@
+"""Unit tests for fc_abstract.py."""
+
+# standard library
+import unittest
+
+# third party
+import numpy as np
+
+# py3tester coverage target
+__test_target__ = 'delphi.flu_contest.forecasters.fc_abstract'
+
+
+class TargetsTests(unittest.TestCase):
+  """Tests for the `Targets` class."""
+
+  def test_get_all_targets_batch(self):
+    """Batch targets agree with per-curve targets, including `.x5` ties."""
+    rng = np.random.RandomState(0)
+    curves = np.round(np.maximum(rng.normal(2.3, 1.2, (60, 20)), 0), 2)
+    curves[:10] = 2.35
+    curves[10:20, ::2] = 4.45
+    curves[20:30, 1::3] = 0.05
+    curves[30:40, 5:9] = 1.15
+
+    for baseline in (None, 1.2, 2.2):
+      for rule_season in (None, 2015, 2017):
+        for current_index in (0, 5, 30):
+          batch = Targets.get_all_targets_batch(
+              curves, baseline, current_index, rule_season)
+          for i, curve in enumerate(curves.tolist()):
+            targets = Targets.get_all_targets(
+                curve, baseline, current_index, rule_season)
+            for name, value in targets.items():
+              with self.subTest(
+                  baseline=baseline,
+                  rule_season=rule_season,
+                  current_index=current_index,
+                  curve=i,
+                  target=name):
+                self.assertEqual(batch[name][i], value)
+
+  def test_get_all_targets_batch_empty(self):
+    """No curves gives empty targets."""
+    for curves in ([], np.zeros((0, 20))):
+      targets = Targets.get_all_targets_batch(curves, 1.2, 0, 2017)
+      self.assertEqual(set(targets), {
+        'onset', 'peakweek', 'peak', 'x1', 'x2', 'x3', 'x4'
+      })
+      for values in targets.values():
+        self.assertEqual(list(values), [])
+
+
+class UtilsTests(unittest.TestCase):
+  """Tests for the `Forecaster.Utils` class."""
+
+  def test_sample_normal_diag(self):
+    """Weeks with zero variance are sampled exactly."""
+    np.random.seed(0)
+    mean = [2.35, 1.2, 4.45, 0.05, 3.0]
+    var = [0, 0.5, 0, 0, 1.5]
+    curves = Forecaster.Utils.sample_normal_diag(mean, var, 1000)
+
+    self.assertEqual(curves.shape, (1000, 5))
+    for week in (0, 2, 3):
+      self.assertTrue(np.all(curves[:, week] == mean[week]))
+    for week in (1, 4):
+      self.assertGreater(np.std(curves[:, week]), 0)
+    self.assertTrue(np.all(curves >= 0))
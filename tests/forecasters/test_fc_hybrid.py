@@ -0,0 +1,43 @@
+"""Unit tests for fc_hybrid.py."""
+
+# standard library
+import unittest
+
+# third party
+import numpy as np
+
+# py3tester coverage target
+__test_target__ = 'delphi.flu_contest.forecasters.fc_hybrid'
+
+
+def join_lists(past, future, index):
+  """The original list-based join, for comparison."""
+  curves = []
+  for j in range(max(len(past), len(future))):
+    p, f = past[j % len(past)], future[j % len(future)]
+    curves.append(list(p[:index]) + list(f[index:]))
+  return curves
+
+
+class UnitTests(unittest.TestCase):
+  """Basic unit tests."""
+
+  def test_join_curves(self):
+    """Curves are joined like the list-based join."""
+    rng = np.random.RandomState(0)
+    for num_past, num_future in ((5, 5), (3, 7), (7, 3), (1, 4)):
+      past = rng.rand(num_past, 33).tolist()
+      future = rng.rand(num_future, 33).tolist()
+      for index in (0, 1, 10, 32, 33):
+        with self.subTest(
+            num_past=num_past, num_future=num_future, index=index):
+          curves = _join_curves(past, future, index)
+          self.assertEqual(
+              np.asarray(curves).tolist(), join_lists(past, future, index))
+
+  def test_join_curves_empty(self):
+    """Nothing is joined without any curves."""
+    curves = [[1.0, 2.0, 3.0]]
+    for past, future in (([], []), ([], curves), (curves, [])):
+      with self.subTest(past=past, future=future):
+        self.assertEqual(len(_join_curves(past, future, 1)), 0)
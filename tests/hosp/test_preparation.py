@@ -0,0 +1,76 @@
+"""Unit tests for preparation.py."""
+
+# standard library
+import unittest
+
+# third party
+import numpy as np
+
+# py3tester coverage target
+__test_target__ = 'delphi.flu_contest.hosp.preparation'
+
+
+def make_data(seed=0, num_lags=30):
+  """Synthetic data with some epiweeks missing."""
+  rng = np.random.RandomState(seed)
+  data = {}
+  for week in range(1, 53):
+    for group in range(2):
+      for location in ('ga', 'or'):
+        if week % 7 == 3 and group == 0:
+          continue
+        if rng.rand() < 0.1:
+          continue
+        data[(201800 + week, group, location)] = list(rng.rand(num_lags))
+  return data
+
+
+class UnitTests(unittest.TestCase):
+  """Basic unit tests."""
+
+  def test_fetch_batch(self):
+    """Each row is the same as `fetch` for its key."""
+    data = make_data()
+    keys = sorted(key for key in data if 201812 <= key[0] <= 201840)
+    for lag in (0, 3):
+      for left_window, right_window, backfill_window in (
+          (5, 0, 2), (5, 2, 2), (3, 1, 0), (2, 0, 4)):
+        with self.subTest(
+            lag=lag,
+            left_window=left_window,
+            right_window=right_window,
+            backfill_window=backfill_window):
+          X, cur_Y, Y = fetch_batch(
+              data, keys, lag, left_window, right_window, backfill_window)
+          self.assertEqual(X.shape, (
+            len(keys), (left_window + right_window + 1) * (backfill_window + 1)
+          ))
+          for k, (epiweek, group, location) in enumerate(keys):
+            x, cur_y, y = fetch(
+                data, location, group, epiweek, lag,
+                left_window, right_window, backfill_window)
+            self.assertTrue(np.array_equal(X[k], x.ravel()))
+            self.assertEqual(cur_Y[k], cur_y)
+            self.assertEqual(Y[k], y[0])
+
+  def test_fetch_batch_too_short(self):
+    """Series too short for the windows are an error."""
+    data = make_data(num_lags=4)
+    keys = sorted(key for key in data if 201812 <= key[0] <= 201840)
+    with self.assertRaisesRegex(Exception, 'too short'):
+      fetch_batch(data, keys, 2, 5, 0, 2)
+
+  def test_slice_window(self):
+    """Slicing is the same as fetching with the smaller windows."""
+    data = make_data()
+    keys = sorted(key for key in data if 201812 <= key[0] <= 201840)
+    lag, right_window = 2, 1
+    X, _, _ = fetch_batch(data, keys, lag, 6, right_window, 4)
+    for left_window, backfill_window in ((6, 4), (3, 2), (0, 0), (6, 1)):
+      with self.subTest(
+          left_window=left_window, backfill_window=backfill_window):
+        expected, _, _ = fetch_batch(
+            data, keys, lag, left_window, right_window, backfill_window)
+        actual = slice_window(
+            X, 6, 4, left_window, right_window, backfill_window)
+        self.assertTrue(np.array_equal(actual, expected))